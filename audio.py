@@ -0,0 +1,448 @@
+import os
+import threading
+import time
+import uuid
+import wave
+
+import numpy as np
+
+# Format of the live audio feed piped into ffmpeg (s16le)
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+
+def resample(samples, src_rate, dst_rate):
+    """Linear resampling of a (frames, channels) float array"""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+
+    n_out = int(round(len(samples) * dst_rate / src_rate))
+    src_positions = np.arange(n_out) * (src_rate / dst_rate)
+    indices = np.arange(len(samples))
+    return np.stack(
+        [np.interp(src_positions, indices, samples[:, ch]) for ch in range(samples.shape[1])],
+        axis=1,
+    )
+
+
+def load_pcm(
+    audio_file,
+    sample_rate=AUDIO_SAMPLE_RATE,
+    channels=AUDIO_CHANNELS,
+    raw_sample_rate=22050,
+):
+    """Decode a WAV file to int16 PCM of shape (frames, channels).
+
+    Files without a RIFF header (ElevenLabs pcm_22050 output is saved as
+    raw samples) are read as mono 16 bit at `raw_sample_rate`.
+    """
+    try:
+        with wave.open(audio_file, "rb") as wav_file:
+            src_rate = wav_file.getframerate()
+            src_channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            data = wav_file.readframes(wav_file.getnframes())
+    except wave.Error:
+        with open(audio_file, "rb") as raw_file:
+            data = raw_file.read()
+        src_rate, src_channels, sample_width = raw_sample_rate, 1, 2
+        data = data[: len(data) - len(data) % 2]
+
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype=np.int32).astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+
+    samples = samples.reshape(-1, src_channels)
+
+    if src_channels == 1 and channels > 1:
+        samples = np.repeat(samples, channels, axis=1)
+    else:
+        samples = samples[:, :channels]
+
+    samples = resample(samples, src_rate, sample_rate)
+    return np.clip(samples * 32768, -32768, 32767).astype(np.int16)
+
+
+def scale_pcm(samples, gain):
+    """int16 samples multiplied by `gain`, clipped"""
+    if gain == 1.0:
+        return samples
+    return np.clip(samples.astype(np.float32) * gain, -32768, 32767).astype(np.int16)
+
+
+class PCMStream:
+    """Growing int16 PCM buffer filled chunk by chunk from a TTS stream.
+
+    Producers push() raw 16 bit mono chunks as they arrive (converted to the
+    feed format on the way in) and call finish() at the end, consumers read
+    whatever is available so playback can start on the first chunk.
+
+    Chunks are copied into a preallocated buffer that doubles when full, so
+    appending and reading stay cheap however long the utterance gets.
+    Subscribers are called on the producer's thread after every append and
+    on finish(), e.g. to analyze the audio as it arrives.
+    """
+
+    def __init__(
+        self, src_rate, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS
+    ):
+        self.src_rate = src_rate
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.lock = threading.Lock()
+        self.buffer = np.zeros((0, channels), dtype=np.int16)
+        self.length = 0
+        self.carry = b""
+        self.finished = False
+        self.listeners = []
+
+    @classmethod
+    def from_samples(cls, samples, sample_rate=AUDIO_SAMPLE_RATE):
+        """Wrap an already decoded (frames, channels) int16 buffer"""
+        stream = cls(sample_rate, sample_rate=sample_rate, channels=samples.shape[1])
+        stream.buffer = samples
+        stream.length = len(samples)
+        stream.finished = True
+        return stream
+
+    def push(self, data):
+        data = self.carry + data
+        usable = len(data) - len(data) % 2
+        self.carry = data[usable:]
+        if not usable:
+            return
+
+        samples = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32)
+        samples = resample(samples.reshape(-1, 1), self.src_rate, self.sample_rate)
+        samples = np.repeat(samples, self.channels, axis=1)
+        self.extend(np.clip(samples, -32768, 32767).astype(np.int16))
+
+    def extend(self, samples):
+        """Append samples already in the feed format"""
+        with self.lock:
+            end = self.length + len(samples)
+            if end > len(self.buffer):
+                # Readers may still hold views of the old buffer, which
+                # stays valid, only the part past `length` is ever written
+                grown = np.zeros(
+                    (max(end, len(self.buffer) * 2, self.sample_rate), self.channels),
+                    dtype=np.int16,
+                )
+                grown[: self.length] = self.buffer[: self.length]
+                self.buffer = grown
+            self.buffer[self.length : end] = samples
+            self.length = end
+        self.notify()
+
+    def finish(self):
+        with self.lock:
+            self.finished = True
+        self.notify()
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def notify(self):
+        for callback in self.listeners:
+            callback()
+
+    def __len__(self):
+        with self.lock:
+            return self.length
+
+    def read(self, position, count):
+        """Up to `count` samples from `position`, fewer if not arrived yet"""
+        with self.lock:
+            return self.buffer[position : min(position + count, self.length)]
+
+    def exhausted(self, position):
+        return self.finished and position >= len(self)
+
+
+class AudioSpool:
+    """Directory of per-utterance audio files with reference counted cleanup.
+
+    Every utterance gets its own uniquely named file, so several can be
+    synthesized ahead while another one is playing, and a file is removed
+    as soon as its last reference is released.
+    """
+
+    def __init__(self, directory="audio_spool"):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.refs = {}
+
+        os.makedirs(directory, exist_ok=True)
+        # Leftovers of a previous run are never referenced again
+        for name in os.listdir(directory):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+    def allocate(self, suffix=".wav"):
+        """New unique path holding one reference"""
+        path = os.path.join(self.directory, uuid.uuid4().hex + suffix)
+        with self.lock:
+            self.refs[path] = 1
+        return path
+
+    def release(self, path):
+        with self.lock:
+            self.refs[path] -= 1
+            if self.refs[path] > 0:
+                return
+            del self.refs[path]
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class UtteranceAudio:
+    """Audio of one utterance, uniquely identified.
+
+    `stream` holds the PCM in the feed format, either complete or still
+    being filled by a streaming synthesis. Utterances synthesized to a file
+    also keep `path`, a reference in an AudioSpool that release() drops.
+    """
+
+    def __init__(self, stream, path=None, spool=None):
+        self.id = uuid.uuid4().hex
+        self.stream = stream
+        self.path = path
+        self.spool = spool
+
+    @classmethod
+    def from_file(cls, path, spool=None):
+        """Decode a synthesized file, keeping the spool reference"""
+        return cls(PCMStream.from_samples(load_pcm(path)), path=path, spool=spool)
+
+    def release(self):
+        if self.spool is not None:
+            self.spool.release(self.path)
+
+
+class AudioFeed:
+    """Continuous real-time PCM feed for a long-lived ffmpeg process.
+
+    A background thread writes `chunk_ms` of audio to the pipe every
+    `chunk_ms`, on a monotonic deadline. While idle the chunks are silence;
+    play() splices an utterance in at the current position of the stream,
+    so ffmpeg never has to be restarted to change its audio input.
+
+    An utterance still being synthesized (PCMStream) plays as its chunks
+    arrive. On an underrun silence is sent and the position waits, so the
+    playback position used for lip-sync stays in step with what is streamed.
+
+    The feed is also the mixer and the only audio clock: a looping music
+    bed and one-shot sound effects are summed with the voice in every
+    chunk, while playback positions and completion refer to the voice.
+    """
+
+    def __init__(
+        self, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS, chunk_ms=20
+    ):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.chunk_frames = sample_rate * chunk_ms // 1000
+        self.chunk_seconds = self.chunk_frames / sample_rate
+        self.silence = np.zeros((self.chunk_frames, channels), dtype=np.int16)
+
+        self.lock = threading.Lock()
+        self.fd = None
+        self.current = None
+        self.position = 0
+
+        self.music = None
+        self.music_position = 0
+        self.effects = []
+
+        self.running = False
+        self.thread = None
+
+    def attach(self, fd):
+        """Switch output to a new pipe, used when ffmpeg is (re)started"""
+        with self.lock:
+            old_fd, self.fd = self.fd, fd
+        if old_fd is not None:
+            try:
+                os.close(old_fd)
+            except OSError:
+                pass
+
+    def play(self, source):
+        """Start streaming an int16 (frames, channels) buffer or a PCMStream"""
+        if not isinstance(source, PCMStream):
+            source = PCMStream.from_samples(source, sample_rate=self.sample_rate)
+        with self.lock:
+            self.current = source
+            self.position = 0
+
+    def set_music(self, samples, gain=0.2):
+        """Loop int16 (frames, channels) `samples` under everything, None stops it"""
+        if samples is not None:
+            samples = scale_pcm(samples, gain)
+        with self.lock:
+            self.music = samples if samples is None or len(samples) else None
+            self.music_position = 0
+
+    def play_effect(self, samples, gain=1.0):
+        """Mix a one-shot sound in from the current position"""
+        with self.lock:
+            self.effects.append([scale_pcm(samples, gain), 0])
+
+    def is_busy(self):
+        return self.current is not None
+
+    def playback_position(self, source):
+        """Samples of `source` streamed so far, None once it is not playing"""
+        with self.lock:
+            if self.current is not source:
+                return None
+            return self.position
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.feed_worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=2):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        self.attach(None)
+
+    def next_voice(self):
+        if self.current is None:
+            return self.silence[:0]
+
+        chunk = self.current.read(self.position, self.chunk_frames)
+        self.position += len(chunk)
+
+        if self.current.exhausted(self.position):
+            self.current = None
+            self.position = 0
+        return chunk
+
+    def next_music(self):
+        if self.music is None:
+            return None
+
+        indices = (self.music_position + np.arange(self.chunk_frames)) % len(self.music)
+        self.music_position = (self.music_position + self.chunk_frames) % len(self.music)
+        return self.music[indices]
+
+    def next_effects(self):
+        chunks = []
+        for effect in self.effects:
+            samples, position = effect
+            chunks.append(samples[position : position + self.chunk_frames])
+            effect[1] += self.chunk_frames
+        self.effects = [effect for effect in self.effects if effect[1] < len(effect[0])]
+        return chunks
+
+    def next_chunk(self):
+        with self.lock:
+            chunk = self.next_voice()
+            music = self.next_music()
+            effects = self.next_effects()
+
+        if music is None and not effects:
+            if len(chunk) < self.chunk_frames:
+                chunk = np.concatenate([chunk, self.silence[len(chunk) :]])
+            return chunk
+
+        mix = np.zeros((self.chunk_frames, self.channels), dtype=np.int32)
+        mix[: len(chunk)] += chunk
+        if music is not None:
+            mix += music
+        for effect in effects:
+            mix[: len(effect)] += effect
+        return np.clip(mix, -32768, 32767).astype(np.int16)
+
+    def write(self, data):
+        fd = self.fd
+        if fd is None:
+            return
+
+        view = memoryview(data).cast("B")
+        try:
+            while len(view):
+                written = os.write(fd, view)
+                view = view[written:]
+        except OSError:
+            # ffmpeg went away, keep the clock running until re-attached
+            pass
+
+    def feed_worker(self):
+        deadline = time.monotonic()
+
+        while self.running:
+            self.write(np.ascontiguousarray(self.next_chunk()))
+
+            deadline += self.chunk_seconds
+            now = time.monotonic()
+            if deadline > now:
+                time.sleep(deadline - now)
+            elif now - deadline > 1.0:
+                # Pipe was blocked for a long time, resync instead of bursting
+                deadline = now
+
+
+class AudioTimeline:
+    """PCM timeline that audio segments are mixed into as they are added.
+
+    Every unique file is decoded once and kept in memory. Adding a segment
+    sums its samples into an int32 accumulator at the segment offset with a
+    single vectorized add, so mixing costs scale with the total audio length
+    rather than with the number of segments. Samples are summed without
+    renormalization and clipped to int16 when read.
+    """
+
+    def __init__(self, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.decoded = {}
+        self.buffer = np.zeros((sample_rate * 10, channels), dtype=np.int32)
+        self.length = 0
+
+    def decode(self, audio_file):
+        if audio_file not in self.decoded:
+            self.decoded[audio_file] = load_pcm(
+                audio_file, sample_rate=self.sample_rate, channels=self.channels
+            )
+        return self.decoded[audio_file]
+
+    def add(self, audio_file, start_sample):
+        """Mix a file in at `start_sample`, returns its length in samples"""
+        samples = self.decode(audio_file)
+        end = start_sample + len(samples)
+
+        if end > len(self.buffer):
+            grown = np.zeros((max(end, len(self.buffer) * 2), self.channels), dtype=np.int32)
+            grown[: self.length] = self.buffer[: self.length]
+            self.buffer = grown
+
+        self.buffer[start_sample:end] += samples
+        self.length = max(self.length, end)
+        return len(samples)
+
+    def read(self, start, count):
+        """int16 samples [start, start + count), silence past the end"""
+        out = np.zeros((count, self.channels), dtype=np.int16)
+        end = min(start + count, self.length)
+        if end > start:
+            np.clip(self.buffer[start:end], -32768, 32767, out=out[: end - start], casting="unsafe")
+        return out
+
+    def mixdown(self):
+        """The whole mixed track as int16"""
+        return self.read(0, self.length)
@@ -0,0 +1,94 @@
+"""Compare the local expression classifier with the LLM expression call.
+
+Measures the latency of both and how often they pick the same expression,
+overall and for the lines the classifier is confident about (the ones the
+engine no longer sends to the LLM).
+
+    python benchmark_expressions.py --count 20
+    python benchmark_expressions.py --lines lines.txt
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from expressions import ExpressionClassifier, resolve_expression
+from prompts import BIO_PROMPT, GENERATE_EXPRESSION_PROMPT
+
+
+def latency_summary(seconds):
+    ms = np.array(seconds) * 1000
+    return (
+        f"mean {ms.mean():.3f}ms p50 {np.percentile(ms, 50):.3f}ms "
+        f"p95 {np.percentile(ms, 95):.3f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="Resources/Mao/Mao.model3.json")
+    parser.add_argument("--lexicon", default="Resources/Mao/expression_lexicon.json")
+    parser.add_argument("--lines", help="Text file with one utterance per line")
+    parser.add_argument("--count", type=int, default=20, help="Lines to generate without --lines")
+    args = parser.parse_args()
+
+    load_dotenv()
+    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", api_key=os.environ["GEMINI_API_KEY"])
+
+    with open(args.model, "r") as file:
+        expressions = json.load(file)["FileReferences"].get("Expressions", [])
+    expression_names = [expression["Name"] for expression in expressions]
+    classifier = ExpressionClassifier.from_config(args.lexicon, expression_names)
+
+    if args.lines:
+        with open(args.lines, "r") as file:
+            lines = [line.strip() for line in file if line.strip()]
+    else:
+        print(f"Generating {args.count} lines...")
+        chain = BIO_PROMPT | llm
+        lines = [
+            chain.invoke({"expressions": expression_names}).content.replace("\n", " ")
+            for _ in range(args.count)
+        ]
+
+    expression_chain = GENERATE_EXPRESSION_PROMPT | llm
+    local_times, llm_times = [], []
+    agreed = confident = confident_agreed = 0
+
+    for line in lines:
+        # Repeat the local call, a single run is below timer resolution
+        started = time.perf_counter()
+        for _ in range(100):
+            local, confidence = classifier.classify(line)
+        local_times.append((time.perf_counter() - started) / 100)
+
+        started = time.perf_counter()
+        response = expression_chain.invoke(
+            {"expression_names": expression_names, "content": line}
+        )
+        llm_times.append(time.perf_counter() - started)
+        remote = resolve_expression(response.content, expression_names)
+
+        agreed += local == remote
+        if classifier.is_confident(confidence):
+            confident += 1
+            confident_agreed += local == remote
+        print(f"{local:>22} ({confidence:.2f}) | {remote:<22} | {line[:50]}")
+
+    print()
+    print(f"Lines: {len(lines)}")
+    print(f"Local: {latency_summary(local_times)}")
+    print(f"LLM:   {latency_summary(llm_times)}")
+    print(f"Agreement: {agreed / len(lines):.0%}")
+    print(f"Confident: {confident / len(lines):.0%} of lines, LLM fallback for the rest")
+    if confident:
+        print(f"Agreement when confident: {confident_agreed / confident:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import ctypes
+import queue
+import numpy as np
+from OpenGL.GL import *
+
+from background import create_program
+
+
+def frame_layout(width, height, pix_fmt="bgr24"):
+    """Buffer shape, GL read format and read height for a piped pixel format.
+
+    bgr24 frames are 3 bytes per pixel, read bottom-up. yuv420p frames are
+    the three I420 planes packed into a single channel image of
+    width x height * 3/2, produced top-down by YUV420Converter.
+    """
+    if pix_fmt == "bgr24":
+        return (height, width, 3), GL_BGR, height
+    if pix_fmt == "yuv420p":
+        return (height * 3 // 2, width), GL_RED, height * 3 // 2
+    raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+
+class FramePool:
+    """Fixed set of preallocated frame buffers shared by capture and encoder.
+
+    Frames are stored exactly as OpenGL returns them. For bgr24 that is
+    BGR with bottom-up rows, the vertical flip is left to ffmpeg
+    (-vf vflip, which only negates the line stride) so no extra pass over
+    the pixels is made in Python.
+    """
+
+    def __init__(self, width, height, size=1, pix_fmt="bgr24"):
+        self.width = width
+        self.height = height
+        shape, _, _ = frame_layout(width, height, pix_fmt)
+        self.frame_size = int(np.prod(shape))
+        self.free = queue.Queue()
+        for _ in range(size):
+            self.free.put(np.empty(shape, dtype=np.uint8))
+
+    def acquire(self, block=False, timeout=None):
+        """Take a buffer out of the pool, returns None if none is free"""
+        try:
+            return self.free.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, frame):
+        """Give a buffer back to the pool once it has been consumed"""
+        self.free.put(frame)
+
+
+def frame_view(frame):
+    """Flat byte view of a pooled frame, for writing to a pipe without a copy"""
+    return memoryview(frame).cast("B")
+
+
+def capture_frame_into(width, height, out, read_buffer=GL_BACK, pix_fmt="bgr24"):
+    """Synchronously read the current frame into a preallocated frame"""
+    try:
+        _, gl_format, read_height = frame_layout(width, height, pix_fmt)
+        # Make sure all OpenGL commands are completed before reading pixels
+        glFinish()
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadBuffer(read_buffer)
+        glReadPixels(0, 0, width, read_height, gl_format, GL_UNSIGNED_BYTE, out)
+        return True
+    except Exception as e:
+        print(f"Error capturing frame: {e}")
+        return False
+
+
+class PBOFrameReader:
+    """Asynchronous frame readback through a ring of pixel buffer objects.
+
+    Each call to read_into() queues a glReadPixels into the next PBO of the
+    ring (which returns immediately, the DMA runs on the GPU side) and maps
+    the oldest PBO, whose transfer has already finished. The returned frame
+    is therefore ring_size - 1 frames behind the one just rendered, but the
+    render thread never waits for the whole GPU pipeline to drain.
+    """
+
+    def __init__(
+        self, width, height, ring_size=2, read_buffer=GL_BACK, pix_fmt="bgr24"
+    ):
+        self.width = width
+        self.height = height
+        self.read_buffer = read_buffer
+        self.ring_size = max(2, ring_size)
+        shape, self.gl_format, self.read_height = frame_layout(width, height, pix_fmt)
+        self.frame_size = int(np.prod(shape))
+        self.index = 0
+        self.frames_queued = 0
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+
+        self.pbos = list(np.atleast_1d(glGenBuffers(self.ring_size)))
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.frame_size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def read_into(self, out):
+        """Start the readback of the current frame and copy a finished one.
+
+        The finished frame is copied straight from the mapped PBO into `out`
+        (a FramePool buffer) as laid out by frame_layout. Returns False while
+        the ring is still filling up (the first ring_size - 1 frames).
+        """
+        glReadBuffer(self.read_buffer)
+
+        # Queue the transfer of the current frame, no CPU wait here
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[self.index])
+        glReadPixels(
+            0,
+            0,
+            self.width,
+            self.read_height,
+            self.gl_format,
+            GL_UNSIGNED_BYTE,
+            ctypes.c_void_p(0),
+        )
+
+        self.index = (self.index + 1) % self.ring_size
+        self.frames_queued += 1
+
+        if self.frames_queued < self.ring_size:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            return False
+
+        # The oldest buffer in the ring is the next one to be overwritten
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[self.index])
+        try:
+            ptr = glMapBufferRange(
+                GL_PIXEL_PACK_BUFFER, 0, self.frame_size, GL_MAP_READ_BIT
+            )
+            if not ptr:
+                return False
+
+            try:
+                data = ctypes.cast(
+                    ptr, ctypes.POINTER(ctypes.c_ubyte * self.frame_size)
+                ).contents
+                np.copyto(
+                    out.reshape(-1), np.frombuffer(data, dtype=np.uint8)
+                )
+                return True
+            finally:
+                glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        finally:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def release(self):
+        """Delete the PBOs, must be called while the GL context is alive"""
+        if self.pbos:
+            glDeleteBuffers(len(self.pbos), self.pbos)
+            self.pbos = []
+
+
+class OffscreenTarget:
+    """Framebuffer object used as the render target instead of a window"""
+
+    read_buffer = GL_COLOR_ATTACHMENT0
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+        self.fbo = glGenFramebuffers(1)
+        self.color_rb, self.depth_stencil_rb = glGenRenderbuffers(2)
+
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth_stencil_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color_rb
+        )
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self.depth_stencil_rb
+        )
+
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f"Offscreen framebuffer incomplete: {status}")
+
+        self.bind()
+
+    def bind(self):
+        """Bind for drawing and reading, live2d renders into whatever is bound"""
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+
+    def blit_to(self, dst_fbo, width, height):
+        """Scale the frame into another framebuffer on the GPU.
+
+        The destination (0 for the window) is left bound, so the frame is
+        read back at the output size.
+        """
+        same_size = (width, height) == (self.width, self.height)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, dst_fbo)
+        glBlitFramebuffer(
+            0,
+            0,
+            self.width,
+            self.height,
+            0,
+            0,
+            width,
+            height,
+            GL_COLOR_BUFFER_BIT,
+            GL_NEAREST if same_size else GL_LINEAR,
+        )
+        glBindFramebuffer(GL_FRAMEBUFFER, dst_fbo)
+        glViewport(0, 0, width, height)
+
+    def release(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteRenderbuffers(2, [self.color_rb, self.depth_stencil_rb])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+class YUV420Converter:
+    """GPU pass converting the rendered frame to planar YUV420 (I420).
+
+    The frame is copied into a texture and a fragment shader writes the Y,
+    U and V planes, already in ffmpeg's memory order and top-down, into a
+    single channel framebuffer of width x height * 3/2. Reading that back
+    moves half the bytes of bgr24 and ffmpeg can encode it without swscale.
+    Colors use BT.601 limited range, the yuv420p default.
+    """
+
+    vertex_shader = """#version 330 core
+    void main() {
+        // Full screen triangle, no vertex buffer needed
+        vec2 position = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+        gl_Position = vec4(position * 2.0 - 1.0, 0.0, 1.0);
+    }
+    """
+
+    frag_shader = """#version 330 core
+    uniform sampler2D src;
+    uniform ivec2 size;
+    out vec4 out_color;
+
+    vec3 rgb_at(ivec2 p) {
+        // p counts rows from the top, the texture from the bottom
+        return texelFetch(src, ivec2(p.x, size.y - 1 - p.y), 0).rgb;
+    }
+
+    void main() {
+        int width = size.x;
+        int height = size.y;
+        ivec2 o = ivec2(gl_FragCoord.xy);
+
+        if (o.y < height) {
+            vec3 c = rgb_at(o);
+            out_color = vec4((16.0 + dot(c, vec3(65.481, 128.553, 24.966))) / 255.0);
+            return;
+        }
+
+        int plane_size = width * height / 4;
+        int index = (o.y - height) * width + o.x;
+        bool is_v = index >= plane_size;
+        if (is_v) {
+            index -= plane_size;
+        }
+
+        ivec2 p = ivec2(index % (width / 2), index / (width / 2)) * 2;
+        vec3 c = (rgb_at(p) + rgb_at(p + ivec2(1, 0))
+                  + rgb_at(p + ivec2(0, 1)) + rgb_at(p + ivec2(1, 1))) * 0.25;
+
+        float chroma = is_v
+            ? 128.0 + dot(c, vec3(112.0, -93.786, -18.214))
+            : 128.0 + dot(c, vec3(-37.797, -74.203, 112.0));
+        out_color = vec4(chroma / 255.0);
+    }
+    """
+
+    read_buffer = GL_COLOR_ATTACHMENT0
+
+    def __init__(self, width, height):
+        if width % 2 or height % 4:
+            raise ValueError("GPU YUV420 needs an even width and a height divisible by 4")
+
+        self.width = width
+        self.height = height
+        self.out_height = height * 3 // 2
+        self.prev_read_fbo = 0
+
+        self.program = create_program(self.vertex_shader, self.frag_shader)
+        self.vao = glGenVertexArrays(1)
+
+        self.src_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.src_texture)
+        glTexImage2D(
+            GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None
+        )
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        self.out_rb = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.out_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_R8, width, self.out_height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        prev_fbo = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.out_rb
+        )
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindFramebuffer(GL_FRAMEBUFFER, prev_fbo)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f"YUV framebuffer incomplete: {status}")
+
+        glUseProgram(self.program)
+        glUniform1i(glGetUniformLocation(self.program, "src"), 0)
+        glUniform2i(glGetUniformLocation(self.program, "size"), width, height)
+        glUseProgram(0)
+
+    def convert(self, read_buffer=GL_BACK):
+        """Convert the current frame, leaving the YUV image bound for reading.
+
+        Call finish() once the frame has been read back.
+        """
+        draw_fbo = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        self.prev_read_fbo = glGetIntegerv(GL_READ_FRAMEBUFFER_BINDING)
+
+        # GPU side copy of the rendered frame into the source texture
+        glReadBuffer(read_buffer)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.src_texture)
+        glCopyTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, 0, 0, self.width, self.height)
+
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.out_height)
+        for cap in (GL_BLEND, GL_DEPTH_TEST, GL_STENCIL_TEST, GL_SCISSOR_TEST, GL_CULL_FACE):
+            glDisable(cap)
+
+        glUseProgram(self.program)
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_TRIANGLES, 0, 3)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, draw_fbo)
+        glViewport(0, 0, self.width, self.height)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+
+    def finish(self):
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.prev_read_fbo)
+
+    def release(self):
+        glDeleteFramebuffers(1, [self.fbo])
+        glDeleteRenderbuffers(1, [self.out_rb])
+        glDeleteTextures([self.src_texture])
+        glDeleteVertexArrays(1, [self.vao])
+        glDeleteProgram(self.program)
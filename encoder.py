@@ -0,0 +1,204 @@
+import queue
+import threading
+import time
+from enum import Enum
+
+from capture import FramePool, frame_view
+
+
+class OverflowPolicy(Enum):
+
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    DUPLICATE_LAST = "duplicate_last"
+
+
+class FrameWriter:
+    """Writes captured frames to the ffmpeg stdin pipe from its own thread.
+
+    The render loop hands frames over through a bounded queue and never
+    blocks on the pipe. When the encoder or the uplink falls behind and the
+    queue is full, the overflow policy decides which frame is thrown away:
+
+    - DROP_OLDEST: the oldest queued frame is dropped, the newest kept
+    - DROP_NEWEST: the incoming frame is dropped
+    - DUPLICATE_LAST: like DROP_OLDEST, and additionally the writer paces
+      itself at `fps`, re-sending the last frame whenever the renderer
+      misses a slot, so ffmpeg always receives exactly `fps` frames/sec
+
+    ffmpeg timestamps raw video by frame count while the audio runs in real
+    time, so a dropped frame never loses its slot: its repeat count moves
+    to the frame that is kept, or to the next one submitted.
+    """
+
+    def __init__(
+        self,
+        width,
+        height,
+        get_process,
+        fps=30,
+        max_queue=4,
+        policy=OverflowPolicy.DROP_OLDEST,
+        pix_fmt="bgr24",
+    ):
+        self.get_process = get_process
+        self.fps = fps
+        self.policy = policy
+        self.frames = queue.Queue(maxsize=max_queue)
+        # queued frames + one being filled + one being written + last held
+        self.pool = FramePool(width, height, size=max_queue + 3, pix_fmt=pix_fmt)
+
+        self.running = False
+        self.thread = None
+        self.last_frame = None
+        # Frame slots lost before reaching the queue, written with the next frame
+        self.lost_slots = 0
+
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.frames_duplicated = 0
+        self.write_errors = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.writer_worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=2):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        print(f"Frame writer stopped: {self.stats()}")
+
+    def acquire(self, repeat=1):
+        """Get a free frame buffer to capture into, None if all are in flight.
+        The `repeat` slots the frame stood for are then made up by the next one."""
+        frame = self.pool.acquire()
+        if frame is None:
+            self.frames_dropped += 1
+            self.lost_slots += repeat
+        return frame
+
+    def discard(self, frame, repeat=1):
+        """Return a frame that was acquired but not captured"""
+        self.pool.release(frame)
+        self.lost_slots += repeat
+
+    def submit(self, frame, repeat=1):
+        """Queue a captured frame, never blocks the caller.
+
+        `repeat` > 1 writes the frame several times, used to fill frame
+        slots the render loop had to skip.
+        """
+        repeat += self.lost_slots
+        self.lost_slots = 0
+        try:
+            self.frames.put_nowait((frame, repeat))
+            return True
+        except queue.Full:
+            pass
+
+        self.frames_dropped += 1
+
+        if self.policy == OverflowPolicy.DROP_NEWEST:
+            self.pool.release(frame)
+            self.lost_slots += repeat
+            return False
+
+        try:
+            dropped, dropped_repeat = self.frames.get_nowait()
+            self.pool.release(dropped)
+            repeat += dropped_repeat
+        except queue.Empty:
+            pass
+        # Only the render thread puts frames, so there is room now
+        self.frames.put_nowait((frame, repeat))
+        return True
+
+    def stats(self):
+        return {
+            "written": self.frames_written,
+            "dropped": self.frames_dropped,
+            "duplicated": self.frames_duplicated,
+            "queued": self.frames.qsize(),
+            "errors": self.write_errors,
+        }
+
+    def write(self, frame):
+        process = self.get_process()
+        if process is None:
+            return
+        if process.poll() is not None:
+            # ffmpeg exited, counted so the engine notices and restarts it
+            self.write_errors += 1
+            return
+
+        try:
+            process.stdin.write(frame_view(frame))
+            self.frames_written += 1
+        except Exception as e:
+            print(f"Error sending frame to ffmpeg: {e}")
+            self.write_errors += 1
+
+    def writer_worker(self):
+        if self.policy == OverflowPolicy.DUPLICATE_LAST:
+            self.paced_writer()
+        else:
+            self.queue_writer()
+
+        while True:
+            try:
+                self.pool.release(self.frames.get_nowait()[0])
+            except queue.Empty:
+                break
+
+    def queue_writer(self):
+        """Write frames as fast as they arrive"""
+        while self.running:
+            try:
+                frame, repeat = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            self.write(frame)
+            for _ in range(repeat - 1):
+                self.write(frame)
+                self.frames_duplicated += 1
+            self.pool.release(frame)
+
+    def paced_writer(self):
+        """Write one frame per 1/fps slot, repeating the last one on misses"""
+        interval = 1.0 / self.fps
+        deadline = time.monotonic() + interval
+
+        while self.running:
+            now = time.monotonic()
+            if deadline > now:
+                time.sleep(deadline - now)
+            elif now - deadline > 1.0:
+                # Pipe was blocked for a long time, resync instead of bursting
+                deadline = now
+
+            # Skipped slots are filled by the pacing itself, repeat is unused
+            try:
+                frame, _ = self.frames.get_nowait()
+            except queue.Empty:
+                frame = None
+
+            if frame is not None:
+                self.write(frame)
+                if self.last_frame is not None:
+                    self.pool.release(self.last_frame)
+                self.last_frame = frame
+            elif self.last_frame is not None:
+                self.write(self.last_frame)
+                self.frames_duplicated += 1
+
+            deadline += interval
+
+        if self.last_frame is not None:
+            self.pool.release(self.last_frame)
+            self.last_frame = None
+        # Frame slots lost before reaching the queue, written with the next frame
+        self.lost_slots = 0
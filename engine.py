@@ -1,4 +1,14 @@
 import os
+
+from dotenv import load_dotenv
+
+# .env is read before anything else, HEADLESS picks the OpenGL platform:
+# the headless backend renders through EGL, PyOpenGL has to know before the
+# first OpenGL import
+load_dotenv()
+if os.getenv("HEADLESS") == "1":
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
 import pygame
 import live2d.v3 as live2d
 import threading
@@ -6,7 +16,6 @@ import queue
 import time
 import json
 import random
-import cv2
 import numpy as np
 from OpenGL.GL import *
 from enum import Enum
@@ -14,8 +23,7 @@ from pygame.locals import *
 import wave
 import subprocess
 import asyncio
-
-from live2d.utils.lipsync import WavHandler
+import itertools
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from time import sleep
@@ -25,14 +33,52 @@ from pyht.client import TTSOptions
 from smallest import Smallest
 from elevenlabs import ElevenLabs
 
-from prompts import BIO_PROMPT, LOOK_AROUND_PROMPT, GENERATE_EXPRESSION_PROMPT
+from prompts import (
+    BIO_PROMPT,
+    LOOK_AROUND_PROMPT,
+    GENERATE_EXPRESSION_PROMPT,
+    MONOLOGUE_PROMPT,
+)
+from expressions import ExpressionClassifier, Monologue, resolve_expression
 from speech_generators import (
     generate_speech_elevenlabs,
     generate_speech_playht,
     generate_speech_smallest_ai,
+    stream_speech_elevenlabs,
+    stream_speech_playht,
+    ELEVENLABS_STREAM_SAMPLE_RATE,
+    PLAYHT_STREAM_SAMPLE_RATE,
 )
 
+from audio import (
+    AUDIO_CHANNELS,
+    AUDIO_SAMPLE_RATE,
+    AudioFeed,
+    AudioSpool,
+    PCMStream,
+    UtteranceAudio,
+    load_pcm,
+)
 from background import Background
+from encoder import FrameWriter, OverflowPolicy
+from outputs import (
+    OutputFanout,
+    build_abr_args,
+    build_output_args,
+    is_network_output,
+)
+from lipsync import LipSyncTrack
+from repetition import RepetitionGuard
+from scheduler import FrameScheduler
+from tts_cache import TTSCache, cache_key
+from tts_pipeline import ClauseSegmenter, SentencePipeline
+from tts_providers import TTSProviderPool
+from capture import (
+    OffscreenTarget,
+    PBOFrameReader,
+    YUV420Converter,
+    capture_frame_into,
+)
 from chats.Platform import run_interaction
 
 
@@ -43,20 +89,15 @@ class TTS_Options(Enum):
     SMALLESTAI = "smallestai"
 
 
-def capture_frame(width, height):
-    """Capture the current OpenGL frame"""
-    try:
-        # Make sure all OpenGL commands are completed before reading pixels
-        glFinish()
-        # Read from the back buffer instead of front buffer
-        glReadBuffer(GL_BACK)
-        pixels = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
-        image = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)
-        image = np.flipud(image)  # OpenGL has origin at bottom left
-        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # Convert to BGR for OpenCV
-    except Exception as e:
-        print(f"Error capturing frame: {e}")
-        return np.zeros((height, width, 3), dtype=np.uint8)
+class ExpressionMode(Enum):
+
+    # Content from the LLM, expression from the local classifier with the
+    # LLM as fallback when it is unsure
+    LOCAL = "local"
+    # Content and expression from one structured LLM call
+    COMBINED = "combined"
+    # Content and expression from two LLM calls
+    LLM = "llm"
 
 
 class Agent:
@@ -68,7 +109,9 @@ class Agent:
     vowel_params = []
     special_params = []
 
-    audio_path = None
+    audio = None
+    lip_sync = None
+    message = None
     current_expression = None
 
     def __init__(
@@ -80,16 +123,75 @@ class Agent:
         background=False,
         speak=True,
         platform_chat=False,
+        pbo_readback=True,
+        headless=False,
+        frame_queue_size=4,
+        frame_overflow_policy=OverflowPolicy.DROP_OLDEST,
+        gpu_yuv=False,
+        render_size: tuple = None,
+        video_bitrate_kbps=2500,
+        outputs: list = None,
+        abr_renditions: list = None,
+        abr_output_dir="abr",
+        abr_format="hls",
+        stream_speech=False,
+        tts_workers=3,
+        tts_cache_dir="tts_cache",
+        tts_cache_bytes=256 * 1024 * 1024,
+        spectral_visemes=True,
+        tts_providers: list = None,
+        background_music: str = None,
+        music_volume=0.15,
+        expression_mode=ExpressionMode.LOCAL,
+        expression_lexicon="Resources/Mao/expression_lexicon.json",
+        stream_llm=True,
+        lookahead=2,
+        repetition_index="repetition_index.npz",
+        max_regenerations=2,
+        repetition_backoff=5.0,
     ):
 
+        # PyOpenGL binds its platform on import, too late to switch here
+        if headless and os.environ.get("PYOPENGL_PLATFORM") != "egl":
+            raise RuntimeError(
+                "Headless mode needs PYOPENGL_PLATFORM=egl before OpenGL is "
+                "imported, set HEADLESS=1 in the environment or .env"
+            )
+
+        # `display` is the output (capture and stream) size, the model can be
+        # rendered at a different size and scaled on the GPU before capture
         self.display = display
+        self.render_size = render_size or display
+        self.video_bitrate_kbps = video_bitrate_kbps
         self.model_path = model_path
         self.running = True
         self.dx, self.dy = 0.0, 0.0
-        self.look_dx, self.look_dy = display[0] / 2, display[1] / 2
+        render_w, render_h = self.render_size
+        self.look_dx, self.look_dy = render_w / 2, render_h / 2
         self.scale = 1.0
         self.lip_sync_multiplier = 10.0  # Increase multiplier for more sensitivity
-        self.message_queue = queue.Queue()  # Queue for communication between threads
+        # Vowel shapes from formant analysis instead of loudness thresholds
+        self.spectral_visemes = spectral_visemes
+        # Queue for communication between threads, a look-ahead buffer of
+        # utterances prepared while the current one plays
+        self.lookahead = lookahead
+
+        # Near-duplicate lines are caught before any TTS is spent on them
+        self.repetition_guard = None
+        if repetition_index is not None:
+            self.repetition_guard = RepetitionGuard(repetition_index)
+        self.max_regenerations = max_regenerations
+        # A round where all max_regenerations attempts repeated recent lines
+        # is dropped and the next one waits, doubling up to 60s, so a stuck
+        # model can not burn LLM calls in a loop
+        self.repetition_backoff = repetition_backoff
+        self.repetition_delay = repetition_backoff
+        self.message_queue = queue.Queue(maxsize=lookahead)
+        # One slot per utterance generated ahead, taken before the LLM call
+        # and given back when the main thread picks the utterance up, so no
+        # more than `lookahead` are ever paid for in advance
+        self.lookahead_slots = threading.Semaphore(lookahead)
+        self.messages_queued = 0
         self.current_top_clicked_part_id = None
         self.part_ids = []
         self.prompt_response = "Random movement"
@@ -97,34 +199,93 @@ class Agent:
         self.frame_count = 300
         self.tts_option = tts_option
         self.speak = speak
+        self.stream_speech = stream_speech
+        self.expression_mode = expression_mode
+        self.expression_lexicon = expression_lexicon
+        self.expression_classifier = None
+        # With streamed speech, speak LLM output as its clauses complete
+        self.stream_llm = stream_llm
+
+        # Utterances are synthesized per sentence in parallel, streamed ones
+        # play the first sentence while the rest are generated
+        self.sentence_pipeline = None
+        if tts_workers > 1:
+            self.sentence_pipeline = SentencePipeline(
+                self.stream_speech_into, self.synthesize_pcm, workers=tts_workers
+            )
         self.rtmp_url = rtmp_url
-        self.ffmpeg_error_count = 0
+
+        # Every output is fed from the same encode, network outputs of a
+        # multi-output setup are pushed by relays that reconnect on their own
+        self.outputs = list(outputs) if outputs else [rtmp_url]
+        network_outputs = [target for target in self.outputs if is_network_output(target)]
+        # ABR mode replaces the outputs with a ladder of HLS/DASH renditions,
+        # e.g. outputs.DEFAULT_ABR_LADDER
+        self.abr_renditions = abr_renditions
+        self.abr_output_dir = abr_output_dir
+        self.abr_format = abr_format
+
+        self.output_fanout = None
+        if len(self.outputs) > 1 and network_outputs and not abr_renditions:
+            self.output_fanout = OutputFanout(network_outputs)
 
         self.look = {
-            "left": (0, display[1] / 2),
-            "right": (display[0], display[1] / 2),
-            "down": (display[0] / 2, 0),
-            "up": (display[0] / 2, display[1]),
-            "straight": (display[0] / 2, display[1] / 2),
+            "left": (0, render_h / 2),
+            "right": (render_w, render_h / 2),
+            "down": (render_w / 2, 0),
+            "up": (render_w / 2, render_h),
+            "straight": (render_w / 2, render_h / 2),
         }
 
         # Chat integrations
         self.platform_chat_integration = platform_chat
 
-        self.ffmpeg_process = None
-        self.setup_ffmpeg(use_audio_file=False)
+        # Frames piped to ffmpeg are either bgr24 or, with the GPU
+        # conversion pass, planar yuv420p at half the size
+        self.pix_fmt = "yuv420p" if gpu_yuv else "bgr24"
 
-        # Mutex for audio file access
-        self.audio_mutex = threading.Lock()
+        self.ffmpeg_process = None
+        # Restarts of a failing ffmpeg back off exponentially up to
+        # ffmpeg_max_backoff seconds, reset once it stayed up for a while
+        self.ffmpeg_started = 0.0
+        self.ffmpeg_backoff = 1.0
+        self.ffmpeg_max_backoff = 30.0
+        # In-process mixer (voice, music bed, effects), the only audio clock
+        self.audio_feed = AudioFeed()
+        if background_music is not None:
+            self.audio_feed.set_music(load_pcm(background_music), music_volume)
+        self.sound_effects = {}
+        self.setup_ffmpeg()
+
+        # Every utterance owns its audio, files are spooled per utterance
+        self.audio_spool = AudioSpool()
         self.audio_in_use = False
-        self.audio_done = threading.Event()
 
         pygame.init()
-        pygame.mixer.init()
         live2d.init()
 
-        self.screen = pygame.display.set_mode(self.display, DOUBLEBUF | OPENGL)
-        pygame.display.set_caption("Live2D Viewer")
+        # Headless mode renders into an offscreen FBO of an EGL context, no
+        # window, X server or buffer swap
+        self.headless = headless
+        self.gl_context = None
+        self.output_target = None
+        read_buffer = GL_BACK
+
+        if self.headless:
+            from headless import EGLContext
+
+            self.gl_context = EGLContext()
+            self.output_target = OffscreenTarget(self.display[0], self.display[1])
+            read_buffer = self.output_target.read_buffer
+        else:
+            self.screen = pygame.display.set_mode(self.display, DOUBLEBUF | OPENGL)
+            pygame.display.set_caption("Live2D Viewer")
+
+        # A render size different from the output gets its own FBO, blitted
+        # (scaled) into the output framebuffer every frame
+        self.render_target = self.output_target
+        if tuple(self.render_size) != tuple(self.display):
+            self.render_target = OffscreenTarget(*self.render_size)
 
         self.display_bg = background
 
@@ -134,13 +295,41 @@ class Agent:
         if live2d.LIVE2D_VERSION == 3:
             live2d.glewInit()
 
+        self.frame_scheduler = FrameScheduler(self.fps)
+        self.frame_writer = FrameWriter(
+            self.display[0],
+            self.display[1],
+            lambda: self.ffmpeg_process,
+            fps=self.fps,
+            max_queue=frame_queue_size,
+            policy=frame_overflow_policy,
+            pix_fmt=self.pix_fmt,
+        )
+
+        self.render_read_buffer = read_buffer
+        self.yuv_converter = None
+        if gpu_yuv:
+            self.yuv_converter = YUV420Converter(self.display[0], self.display[1])
+            read_buffer = self.yuv_converter.read_buffer
+
+        # Asynchronous readback through a PBO ring, falls back to the
+        # synchronous capture_frame_into when disabled
+        self.frame_reader = None
+        if pbo_readback:
+            self.frame_reader = PBOFrameReader(
+                self.display[0],
+                self.display[1],
+                read_buffer=read_buffer,
+                pix_fmt=self.pix_fmt,
+            )
+        self.read_buffer = read_buffer
+
         self.model = live2d.LAppModel()
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-1.5-pro", api_key=os.environ["GEMINI_API_KEY"]
         )
-        self.wav_handler = WavHandler()
         self.model.LoadModelJson(os.path.join(model_path))
-        self.model.Resize(*display)
+        self.model.Resize(*self.render_size)
 
         # Setup TTS Models
 
@@ -162,6 +351,18 @@ class Agent:
         else:
             raise ValueError("Invalid tts option given")
 
+        # Several providers behind one pool, with failover and hedging
+        self.tts_pool = None
+        if tts_providers:
+            self.tts_pool = TTSProviderPool.from_env(
+                [option.value for option in tts_providers]
+            )
+
+        # Synthesized audio is reused for lines that were already spoken
+        self.tts_cache = None
+        if tts_cache_dir is not None:
+            self.tts_cache = TTSCache(tts_cache_dir, max_bytes=tts_cache_bytes)
+
     def get_audio_duration(self, audio_file):
         """Get the duration of an audio file in seconds"""
         with wave.open(audio_file, "rb") as wav_file:
@@ -212,45 +413,208 @@ class Agent:
                 self.special_params.append(param_id)
                 print(f"Special param: {param_id} (min: {param.min}, max: {param.max})")
 
+    def speech_cache_key(self, text, audio_format):
+        if self.tts_pool is not None:
+            return self.tts_pool.cache_key(text, audio_format)
+        if self.tts_option == TTS_Options.ELEVENLABS:
+            voice_id = os.environ["ELEVENLABS_VOICE_ID"]
+            model_id = os.environ["ELEVENLABS_MODEL_ID"]
+        elif self.tts_option == TTS_Options.PLAYHT:
+            voice_id = os.environ["PLAYHT_VOICE_MANIFEST_URL"]
+            model_id = "PlayDialog"
+        else:
+            voice_id = os.environ["SMALLEST_VOICE_ID"]
+            model_id = os.environ["SMALLEST_MODEL"]
+        return cache_key(self.tts_option.value, voice_id, model_id, text, audio_format)
+
     def generate_speech(self, text):
-        # Create a temporary filename to avoid conflicts
-        # temp_filename = f"output_temp_{int(time.time())}.wav"
-        temp_filename = f"output_temp.wav"
+        """Synthesize `text` into its own spool file, returns UtteranceAudio"""
+        if self.tts_pool is not None:
+            # The pool returns decoded PCM, nothing to spool
+            return UtteranceAudio(PCMStream.from_samples(self.synthesize_pcm(text)))
+
+        audio_file = self.audio_spool.allocate()
+
+        try:
+            key = None
+            cached = None
+            if self.tts_cache is not None:
+                key = self.speech_cache_key(text, "file")
+                cached = self.tts_cache.get(key)
+
+            if cached is not None:
+                with open(audio_file, "wb") as file:
+                    file.write(cached)
+            elif self.tts_option == TTS_Options.ELEVENLABS:
+                generate_speech_elevenlabs(
+                    self.client,
+                    text,
+                    os.environ["ELEVENLABS_VOICE_ID"],
+                    os.environ["ELEVENLABS_MODEL_ID"],
+                    audio_file,
+                )
+            elif self.tts_option == TTS_Options.PLAYHT:
+                generate_speech_playht(
+                    self.client,
+                    text,
+                    os.environ["PLAYHT_VOICE_MANIFEST_URL"],
+                    audio_file,
+                )
+            elif self.tts_option == TTS_Options.SMALLESTAI:
+                generate_speech_smallest_ai(self.client, text, audio_file)
+            else:
+                raise ValueError("Invalid TTS option passed")
+
+            if cached is None and key is not None:
+                self.tts_cache.put_file(key, audio_file)
+
+            # Decoded here, off the render thread
+            return UtteranceAudio.from_file(audio_file, self.audio_spool)
+        except Exception:
+            self.audio_spool.release(audio_file)
+            raise
 
+    def speech_chunks(self, text):
+        """Raw PCM chunk iterator of a streaming provider, None if unsupported"""
+        if self.tts_pool is not None:
+            return None
         if self.tts_option == TTS_Options.ELEVENLABS:
-            generate_speech_elevenlabs(
+            return stream_speech_elevenlabs(
                 self.client,
                 text,
                 os.environ["ELEVENLABS_VOICE_ID"],
                 os.environ["ELEVENLABS_MODEL_ID"],
             )
-        elif self.tts_option == TTS_Options.PLAYHT:
-            generate_speech_playht(
+        if self.tts_option == TTS_Options.PLAYHT:
+            return stream_speech_playht(
                 self.client, text, os.environ["PLAYHT_VOICE_MANIFEST_URL"]
             )
-        elif self.tts_option == TTS_Options.SMALLESTAI:
-            generate_speech_smallest_ai(self.client, text)
+        return None
+
+    def synthesize_pcm(self, text):
+        """Synthesize `text` completely into feed format samples.
+
+        Safe to call from several threads, every call has its own files.
+        """
+        key = self.pcm_cache_key(text)
+        cached = self.cached_pcm(key)
+        if cached is not None:
+            return cached
+
+        samples = self.synthesize_pcm_uncached(text)
+        if key is not None:
+            self.tts_cache.put(key, samples.tobytes())
+        return samples
+
+    def pcm_cache_key(self, text):
+        """Cache key of the feed format samples of `text`, None without a cache"""
+        if self.tts_cache is None:
+            return None
+        return self.speech_cache_key(text, f"s16le_{AUDIO_SAMPLE_RATE}_{AUDIO_CHANNELS}")
+
+    def cached_pcm(self, key):
+        """Cached feed format samples, None on a miss"""
+        cached = self.tts_cache.get(key) if key is not None else None
+        if cached is None:
+            return None
+        return np.frombuffer(cached, dtype=np.int16).reshape(-1, AUDIO_CHANNELS)
+
+    def synthesize_pcm_uncached(self, text):
+        if self.tts_pool is not None:
+            return self.tts_pool.synthesize(text)
+
+        chunks = self.speech_chunks(text)
+        if chunks is not None:
+            audio_stream = PCMStream(self.speech_stream_rate())
+            for chunk in chunks:
+                audio_stream.push(chunk)
+            return audio_stream.read(0, len(audio_stream))
+
+        audio_file = self.audio_spool.allocate()
+        try:
+            generate_speech_smallest_ai(self.client, text, audio_file)
+            return load_pcm(audio_file)
+        finally:
+            self.audio_spool.release(audio_file)
+
+    def stream_speech_into(self, text, audio_stream):
+        """Push TTS audio into `audio_stream` chunk by chunk as it arrives,
+        cached audio in one go. Streamed audio is cached once complete."""
+        key = self.pcm_cache_key(text)
+        cached = self.cached_pcm(key)
+        if cached is not None:
+            audio_stream.extend(cached)
+            return
+
+        chunks = self.speech_chunks(text)
+        if chunks is None:
+            # No streaming API, the whole utterance arrives as one chunk
+            samples = self.synthesize_pcm_uncached(text)
+            audio_stream.extend(samples)
         else:
-            raise ValueError("Invalid TTS option passed")
-
-        # Acquire mutex before renaming file
-        with self.audio_mutex:
-            # If there's an old output file, remove it
-            if os.path.exists("output.wav"):
-                try:
-                    os.remove("output.wav")
-                except:
-                    pass
-
-            # Rename temp file to final filename
-            try:
-                os.rename(temp_filename, "output.wav")
-            except Exception as e:
-                print(f"Error renaming audio file: {e}")
-                # If rename fails, at least return the temp file
-                return temp_filename
+            start = len(audio_stream)
+            for chunk in chunks:
+                audio_stream.push(chunk)
+            samples = audio_stream.read(start, len(audio_stream) - start)
+
+        if key is not None and len(samples):
+            self.tts_cache.put(key, samples.tobytes())
+
+    def fill_speech_stream(self, text, audio_stream):
+        """Synthesize a whole utterance into `audio_stream` and finish it"""
+        if self.sentence_pipeline is not None:
+            self.sentence_pipeline.speak(text, audio_stream)
+            return
+
+        try:
+            self.stream_speech_into(text, audio_stream)
+        finally:
+            audio_stream.finish()
+
+    def speech_stream_rate(self):
+        if self.tts_option == TTS_Options.ELEVENLABS:
+            return ELEVENLABS_STREAM_SAMPLE_RATE
+        if self.tts_option == TTS_Options.PLAYHT:
+            return PLAYHT_STREAM_SAMPLE_RATE
+        return AUDIO_SAMPLE_RATE
+
+    def finish_audio(self):
+        """Drop the current utterance, its spool file goes with the last reference"""
+        if self.audio is not None:
+            self.audio.release()
+        self.audio = None
+        self.lip_sync = None
+        self.message = None
+        self.audio_in_use = False
+
+    def audio_playing(self):
+        return self.audio_feed.is_busy()
+
+    def play_sound_effect(self, audio_file, volume=1.0):
+        """Mix a sound effect into the stream, decoded once per file"""
+        if audio_file not in self.sound_effects:
+            self.sound_effects[audio_file] = load_pcm(audio_file)
+        self.audio_feed.play_effect(self.sound_effects[audio_file], volume)
+
+    def lip_sync_track(self, audio_stream):
+        """Precomputed mouth parameters of an utterance, see LipSyncTrack"""
+        return LipSyncTrack(
+            audio_stream,
+            self.mouth_params,
+            self.vowel_params,
+            self.fps,
+            self.lip_sync_multiplier,
+            spectral=self.spectral_visemes,
+        )
 
-        return "output.wav"
+    def current_lip_sync(self):
+        """(rms, parameter values) at the playback position, None when not speaking"""
+        if self.audio is None or self.lip_sync is None:
+            return None
+        position = self.audio_feed.playback_position(self.audio.stream)
+        if position is None:
+            return None
+        return self.lip_sync.at(position)
 
     # A wrapper to run async function in a thread
     def start_async_interaction(self):
@@ -262,65 +626,304 @@ class Agent:
             )
         )  # Safe because this is in a new thread
 
-    def llm_worker(self):
-        """Worker thread to generate LLM content and speech"""
-
-        generate_expression_chain = GENERATE_EXPRESSION_PROMPT | self.llm
-        generate_response_chain = BIO_PROMPT | self.llm
+    def wait_for_slot(self):
+        """Block until the look-ahead buffer has room, False on shutdown"""
+        while self.running:
+            if self.lookahead_slots.acquire(timeout=0.5):
+                return True
+        return False
 
+    def queue_message(self, message):
+        """Hand an utterance to the main thread, dropped on shutdown"""
         while self.running:
             try:
-                # Wait for previous audio to finish playing
-                if self.audio_in_use:
-                    print("LLM thread: Waiting for audio to finish playing...")
-                    self.audio_done.wait(timeout=10)  # Wait with timeout
-                    self.audio_done.clear()
+                self.message_queue.put(message, timeout=0.5)
+                self.messages_queued += 1
+                return
+            except queue.Full:
+                continue
+        message["audio"].release()
+
+    def generate_monologue(self, chains):
+        """Content and a validated expression of the next utterance"""
+        generate_response_chain, generate_expression_chain, generate_monologue_chain = chains
+
+        if self.expression_mode == ExpressionMode.COMBINED:
+            print("LLM thread: Generating content and expression...")
+            monologue = generate_monologue_chain.invoke(
+                {"expressions": self.expression_names}
+            )
+            if monologue is None or not monologue.content.strip():
+                raise ValueError("Empty structured LLM response")
+            content = monologue.content
+            expression = monologue.expression
+        else:
+            print("LLM thread: Generating content...")
 
-                print("LLM thread: Generating content...")
+            response = generate_response_chain.invoke(
+                {"expressions": self.expression_names}
+            )
+            content = response.content
 
-                response = generate_response_chain.invoke(
-                    {"expressions": self.expression_names}
-                )
-                content = response.content
-                self.prompt_response = content
+            print(f"LLM thread: Content generated: {content[:30]}...")
 
-                print(f"LLM thread: Content generated: {content[:30]}...")
+            expression = None
+            if self.expression_classifier is not None:
+                expression, confidence = self.expression_classifier.classify(content)
+                if not self.expression_classifier.is_confident(confidence):
+                    print(
+                        f"LLM thread: Local expression {expression} unsure "
+                        f"({confidence:.2f}), asking the LLM"
+                    )
+                    expression = None
 
+            if expression is None:
                 # Generate expression
                 print("LLM thread: Generating expression...")
                 response = generate_expression_chain.invoke(
                     {"expression_names": self.expression_names, "content": content}
                 )
                 expression = response.content
-                print(f"LLM thread: Expression generated: {expression}")
-
-                # Generate speech
-                print("LLM thread: Generating speech...")
-                audio_file = self.generate_speech(content)
-                print(f"LLM thread: Speech generated to {audio_file}")
-
-                # Put message in queue for main thread to process
-                print("LLM thread: Putting message in queue...")
-                self.message_queue.put(
-                    {
-                        "content": content,
-                        "expression": expression,
-                        "audio_file": audio_file,
-                        "timestamp": time.time(),
-                    }
+
+        return content, resolve_expression(expression, self.expression_names)
+
+    def generate_fresh_monologue(self, chains):
+        """generate_monologue, regenerated while it repeats a recent line.
+        None when every attempt was a near-duplicate."""
+        for _ in range(self.max_regenerations + 1):
+            content, expression = self.generate_monologue(chains)
+            if self.repetition_guard is None:
+                return content, expression
+            if not self.repetition_guard.is_repetition(content):
+                self.repetition_guard.add(content)
+                return content, expression
+            print("LLM thread: Near-duplicate line, regenerating...")
+        return None
+
+    def fresh_segments(self, generate_response_chain):
+        """(first segment, remaining segments) of a streamed response that
+        does not open like a recent line, regenerated while it does. None
+        when every attempt was a near-duplicate."""
+        for _ in range(self.max_regenerations + 1):
+            segments = self.stream_segments(generate_response_chain)
+            first = next(segments, None)
+            if first is None:
+                raise ValueError("Empty LLM response")
+
+            # Only the opening is known before speech starts, the rest is
+            # checked segment by segment while it is spoken
+            if self.repetition_guard is None or not self.repetition_guard.is_repetition(first):
+                return first, segments
+            segments.close()
+            print("LLM thread: Streamed line opens like a recent one, regenerating...")
+        return None
+
+    def stream_segments(self, generate_response_chain):
+        """Spoken segments of the next utterance, yielded while the LLM is
+        still generating the rest of it"""
+        segmenter = ClauseSegmenter()
+        for chunk in generate_response_chain.stream({"expressions": self.expression_names}):
+            yield from segmenter.feed(chunk.content)
+        yield from segmenter.flush()
+
+    def speak_streamed_monologue(self, generate_response_chain, generate_expression_chain):
+        """Stream the LLM response straight into speech, segment by segment.
+
+        The utterance is queued on its first segment, its expression picked
+        locally from that segment, so the first words play while the LLM is
+        still decoding and later segments are synthesized as they complete.
+        While the classifier is unsure the expression is re-classified over
+        the segments so far, and asked from the LLM once the text is
+        complete; the main thread applies changes while the utterance plays.
+        Returns False when only near-duplicate lines were generated.
+        """
+        print("LLM thread: Streaming content...")
+        fresh = self.fresh_segments(generate_response_chain)
+        if fresh is None:
+            return False
+        first, segments = fresh
+
+        expression, confidence = self.expression_classifier.classify(first)
+        confident = self.expression_classifier.is_confident(confidence)
+        expression = resolve_expression(expression, self.expression_names)
+        print(
+            f"LLM thread: First segment: {first[:30]}... "
+            f"({expression}, {confidence:.2f})"
+        )
+
+        audio_stream = PCMStream(self.speech_stream_rate())
+        message = {
+            "content": first,
+            "expression": expression,
+            "audio": UtteranceAudio(audio_stream),
+            "lip_sync": self.lip_sync_track(audio_stream),
+            "timestamp": time.time(),
+        }
+        # Only worth queueing early when nothing else is ready to play,
+        # otherwise it is completed first and waits in the look-ahead buffer
+        queue_first = self.message_queue.empty()
+        if queue_first:
+            self.queue_message(message)
+
+        spoken = []
+
+        def spoken_segments():
+            for segment in itertools.chain([first], segments):
+                if spoken and self.repetition_guard is not None:
+                    if self.repetition_guard.is_repetition(segment):
+                        continue
+                if self.repetition_guard is not None:
+                    self.repetition_guard.add(segment)
+                spoken.append(segment)
+                yield segment
+                if not confident:
+                    refine(" ".join(spoken))
+
+        def refine(text):
+            nonlocal confident
+            expression, confidence = self.expression_classifier.classify(text)
+            if self.expression_classifier.is_confident(confidence):
+                confident = True
+                message["expression"] = resolve_expression(expression, self.expression_names)
+                print(f"LLM thread: Expression refined to {message['expression']}")
+
+        if self.sentence_pipeline is not None:
+            self.sentence_pipeline.speak_segments(spoken_segments(), audio_stream)
+        else:
+            try:
+                for segment in spoken_segments():
+                    self.stream_speech_into(segment, audio_stream)
+            finally:
+                audio_stream.finish()
+
+        message["content"] = self.prompt_response = " ".join(spoken)
+        print(f"LLM thread: Streamed {len(spoken)} segments")
+
+        if not confident:
+            print("LLM thread: Local expression unsure, asking the LLM")
+            try:
+                response = generate_expression_chain.invoke(
+                    {"expression_names": self.expression_names, "content": message["content"]}
                 )
-                print("LLM thread: Message in queue, sleeping for 3 seconds...")
+                message["expression"] = resolve_expression(
+                    response.content, self.expression_names
+                )
+            except Exception as e:
+                print(f"LLM thread: Keeping {message['expression']}, expression call failed: {e}")
+        if not queue_first:
+            self.queue_message(message)
+        return True
+
+    def back_off_repetition(self):
+        """Drop a round of near-duplicate lines, wait before the next one"""
+        print(
+            f"LLM thread: Only near-duplicate lines generated, line dropped, "
+            f"retrying in {self.repetition_delay:.0f}s"
+        )
+        sleep(self.repetition_delay)
+        self.repetition_delay = min(self.repetition_delay * 2, 60.0)
+
+    def llm_worker(self):
+        """Worker thread to generate LLM content and speech"""
 
-                # Sleep with timeout check to avoid getting stuck
-                start_time = time.time()
-                while time.time() - start_time < 3 and self.running:  # 3 seconds
-                    sleep(15)  # Short sleep to allow for cleaner thread exit
+        generate_expression_chain = GENERATE_EXPRESSION_PROMPT | self.llm
+        generate_response_chain = BIO_PROMPT | self.llm
+        generate_monologue_chain = MONOLOGUE_PROMPT | self.llm.with_structured_output(
+            Monologue
+        )
+        chains = (generate_response_chain, generate_expression_chain, generate_monologue_chain)
+
+        # Token streaming needs the local classifier, the expression is
+        # picked before the content is complete
+        stream_llm = (
+            self.stream_llm
+            and self.stream_speech
+            and self.expression_classifier is not None
+        )
 
-                print("LLM thread: Woke up, starting next iteration")
+        while self.wait_for_slot():
+            queued = self.messages_queued
+            try:
+                if stream_llm:
+                    if not self.speak_streamed_monologue(
+                        generate_response_chain, generate_expression_chain
+                    ):
+                        self.back_off_repetition()
+                        continue
+                else:
+                    monologue = self.generate_fresh_monologue(chains)
+                    if monologue is None:
+                        self.back_off_repetition()
+                        continue
+                    content, expression = monologue
+                    self.prompt_response = content
+                    print(f"LLM thread: Generated: {content[:30]}... ({expression})")
+                    self.speak_monologue(content, expression)
+
+                # No pause, the next one starts as soon as a slot of the
+                # look-ahead buffer is free
+                self.repetition_delay = self.repetition_backoff
+                print(
+                    f"LLM thread: Message in queue "
+                    f"({self.message_queue.qsize()}/{self.lookahead} ready)"
+                )
             except Exception as e:
                 print(f"Error in LLM worker: {e}")
                 # Sleep with shorter timeout for error recovery
                 sleep(2)
+            finally:
+                if self.messages_queued == queued:
+                    # Nothing queued, the slot is free again
+                    self.lookahead_slots.release()
+
+    def speak_monologue(self, content, expression):
+        """Synthesize a complete utterance and queue it for the main thread"""
+        if self.stream_speech:
+            audio_stream = PCMStream(self.speech_stream_rate())
+            message = {
+                "content": content,
+                "expression": expression,
+                "audio": UtteranceAudio(audio_stream),
+                "lip_sync": self.lip_sync_track(audio_stream),
+                "timestamp": time.time(),
+            }
+
+            # With nothing else ready, queue the utterance first: playback
+            # and lip-sync start on the first chunk while synthesis
+            # continues here. Otherwise complete it before buffering.
+            queue_first = self.message_queue.empty()
+            if queue_first:
+                print("LLM thread: Putting streamed message in queue...")
+                self.queue_message(message)
+            print("LLM thread: Streaming speech...")
+            self.fill_speech_stream(content, audio_stream)
+            print("LLM thread: Speech stream complete")
+            if not queue_first:
+                self.queue_message(message)
+        else:
+            # Generate speech
+            print("LLM thread: Generating speech...")
+            if self.sentence_pipeline is not None:
+                audio_stream = PCMStream(self.speech_stream_rate())
+                self.sentence_pipeline.speak(content, audio_stream)
+                audio = UtteranceAudio(audio_stream)
+                print(f"LLM thread: Speech generated ({audio.id})")
+            else:
+                audio = self.generate_speech(content)
+                print(f"LLM thread: Speech generated to {audio.path}")
+
+            # Put message in queue for main thread to process, its
+            # look-ahead slot was taken before generating it
+            print("LLM thread: Putting message in queue...")
+            self.queue_message(
+                {
+                    "content": content,
+                    "expression": expression,
+                    "audio": audio,
+                    "lip_sync": self.lip_sync_track(audio.stream),
+                    "timestamp": time.time(),
+                }
+            )
 
     def idle_motion_worker(self):
 
@@ -384,8 +987,9 @@ class Agent:
             print("Look selected: ", selected)
             sleep(5)
 
-    def setup_ffmpeg(self, use_audio_file=False):
-        """Sets up the ffmpeg process with either silent audio or an audio file"""
+    def setup_ffmpeg(self):
+        """Sets up the long-lived ffmpeg process fed by the frame writer and
+        the live audio feed. Only called again to recover from errors."""
 
         print("Initializing FFMPeg")
         # Kill the current ffmpeg process if it exists
@@ -397,15 +1001,21 @@ class Agent:
             except:
                 self.ffmpeg_process.kill()
 
+        # Audio is streamed continuously through its own pipe, silence while
+        # idle, so utterances never require restarting the encoder
+        audio_read_fd, audio_write_fd = os.pipe()
+
         # Build the ffmpeg command
         ffmpeg_cmd = [
             "ffmpeg",
             "-y",
             # Video Input (from named pipe)
+            "-thread_queue_size",
+            "512",
             "-f",
             "rawvideo",
             "-pix_fmt",
-            "bgr24",
+            self.pix_fmt,
             "-s",
             f"{self.display[0]}x{self.display[1]}",
             "-r",
@@ -414,57 +1024,133 @@ class Agent:
             "-",
         ]
 
-        # Add audio input based on whether we're using an audio file
-        if use_audio_file and os.path.exists("output.wav"):
-            # Audio input from WAV file
-            ffmpeg_cmd.extend(["-i", "output.wav"])
-        else:
-            # Silent audio input
-            ffmpeg_cmd.extend(["-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo"])
-
-        # Add encoding settings and output
+        # Live PCM audio input
         ffmpeg_cmd.extend(
             [
-                # Video Encoding
-                "-c:v",
-                "libx264",
-                "-pix_fmt",
-                "yuv420p",
-                "-preset",
-                "ultrafast",
-                "-tune",
-                "zerolatency",
-                "-b:v",
-                "2500k",
-                "-maxrate",
-                "2500k",
-                "-bufsize",
-                "5000k",
-                "-g",
-                str(self.fps * 2),
-                # Audio Encoding
-                "-c:a",
-                "aac",
-                "-b:a",
-                "128k",
-                # Output Format (FLV for YouTube)
+                "-thread_queue_size",
+                "512",
                 "-f",
-                "flv",
-                self.rtmp_url,
+                "s16le",
+                "-ar",
+                str(AUDIO_SAMPLE_RATE),
+                "-ac",
+                str(AUDIO_CHANNELS),
+                "-i",
+                f"pipe:{audio_read_fd}",
             ]
         )
 
+        pass_fds = [audio_read_fd]
+        relay_write_fd = None
+
+        if self.abr_renditions:
+            # One capture, every rendition scaled and encoded in one graph
+            ffmpeg_cmd.extend(
+                build_abr_args(
+                    self.abr_renditions,
+                    self.abr_output_dir,
+                    self.fps,
+                    vflip=self.pix_fmt == "bgr24",
+                    abr_format=self.abr_format,
+                )
+            )
+        else:
+            # bgr24 frames are piped bottom-up straight from OpenGL, the GPU
+            # YUV pass already writes its planes top-down
+            if self.pix_fmt == "bgr24":
+                ffmpeg_cmd.extend(["-vf", "vflip"])
+
+            # Add encoding settings and output
+            ffmpeg_cmd.extend(
+                [
+                    # Video Encoding
+                    "-c:v",
+                    "libx264",
+                    "-pix_fmt",
+                    "yuv420p",
+                    "-preset",
+                    "ultrafast",
+                    "-tune",
+                    "zerolatency",
+                    "-b:v",
+                    f"{self.video_bitrate_kbps}k",
+                    "-maxrate",
+                    f"{self.video_bitrate_kbps}k",
+                    "-bufsize",
+                    f"{self.video_bitrate_kbps * 2}k",
+                    "-g",
+                    str(self.fps * 2),
+                    # Audio Encoding
+                    "-c:a",
+                    "aac",
+                    "-b:a",
+                    "128k",
+                    "-map",
+                    "0:v",
+                    "-map",
+                    "1:a",
+                ]
+            )
+
+            # Output Format, FLV for a single RTMP url, otherwise one encode
+            # fanned out to every output through the tee muxer
+            if self.output_fanout is not None:
+                relay_read_fd, relay_write_fd = os.pipe()
+                pass_fds.append(relay_write_fd)
+
+            ffmpeg_cmd.extend(build_output_args(self.outputs, relay_write_fd))
+
         # Start the ffmpeg process
         print(
-            f"Starting ffmpeg process: {'with audio file' if use_audio_file else 'with silent audio'}"
+            f"Starting ffmpeg process with live audio feed to "
+            f"{self.abr_output_dir if self.abr_renditions else self.outputs}"
+        )
+        self.ffmpeg_started = time.monotonic()
+        self.ffmpeg_process = subprocess.Popen(
+            ffmpeg_cmd, stdin=subprocess.PIPE, pass_fds=pass_fds
         )
-        self.ffmpeg_process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+        os.close(audio_read_fd)
+        self.audio_feed.attach(audio_write_fd)
+
+        if relay_write_fd is not None:
+            os.close(relay_write_fd)
+            self.output_fanout.attach(relay_read_fd)
+
+    def check_ffmpeg(self):
+        """Restart ffmpeg when it exited or its pipe keeps failing"""
+        exited = self.ffmpeg_process is None or self.ffmpeg_process.poll() is not None
+        now = time.monotonic()
+
+        if not exited and self.frame_writer.write_errors <= 10:
+            if now - self.ffmpeg_started > 60:
+                self.ffmpeg_backoff = 1.0
+            return
+        if now - self.ffmpeg_started < self.ffmpeg_backoff:
+            return
+
+        if exited:
+            code = None if self.ffmpeg_process is None else self.ffmpeg_process.returncode
+            print(f"ffmpeg exited with code {code}, restarting the process")
+        else:
+            print("Too many ffmpeg errors, restarting the process")
+        self.ffmpeg_backoff = min(self.ffmpeg_backoff * 2, self.ffmpeg_max_backoff)
+
+        try:
+            self.setup_ffmpeg()
+        except Exception as e:
+            print(f"Unable to restart ffmpeg: {e}")
+            self.ffmpeg_started = now
+        self.frame_writer.write_errors = 0
 
     def run_agent(self):
         """Main method that runs everything"""
         print("Starting agent....")
 
         self.get_expression_names()
+        if self.expression_mode == ExpressionMode.LOCAL:
+            self.expression_classifier = ExpressionClassifier.from_config(
+                self.expression_lexicon, self.expression_names
+            )
         self.get_motion_names()
         self.get_model_params()
 
@@ -492,6 +1178,11 @@ class Agent:
         motion_thread.daemon = True
         motion_thread.start()
 
+        self.frame_writer.start()
+        self.audio_feed.start()
+        if self.output_fanout is not None:
+            self.output_fanout.start()
+
         print("Main thread: LLM worker thread started")
         print("Main thread: Starting video loop")
 
@@ -505,9 +1196,6 @@ class Agent:
             print("Main thread: Shutting down")
             self.running = False
 
-            # Signal any waiting threads
-            self.audio_done.set()
-
             # Wait for worker thread to finish any current work (with timeout)
             print("Main thread: Waiting for worker thread to exit")
             start_time = time.time()
@@ -526,22 +1214,50 @@ class Agent:
             ):  # 5 second timeout
                 sleep(0.1)
 
+            self.frame_writer.stop()
+            self.audio_feed.stop()
+            if self.output_fanout is not None:
+                self.output_fanout.stop()
+            if self.sentence_pipeline is not None:
+                self.sentence_pipeline.shutdown()
+            if self.tts_pool is not None:
+                self.tts_pool.close()
+            if self.repetition_guard is not None:
+                self.repetition_guard.flush()
+
+            # Utterances prepared ahead and never played
+            while not self.message_queue.empty():
+                self.message_queue.get_nowait()["audio"].release()
+            self.finish_audio()
+
             print("Main thread: Cleaning up PyGame and Live2D")
+            if self.frame_reader is not None:
+                self.frame_reader.release()
+            if self.yuv_converter is not None:
+                self.yuv_converter.release()
+            if self.render_target is not self.output_target:
+                self.render_target.release()
+            if self.output_target is not None:
+                self.output_target.release()
             pygame.quit()
             live2d.dispose()
+            if self.gl_context is not None:
+                self.gl_context.release()
             print("Main thread: Shutdown complete")
 
     def run_video(self):
         """Main video loop - must run in main thread"""
 
-        clock = pygame.time.Clock()
+        self.frame_scheduler.reset()
 
         while self.running:
 
-            frame_start = time.time()
+            # Wait for the next slot on the deadline grid, slots missed by a
+            # slow frame are filled by repeating this frame in the writer
+            skipped_frames = self.frame_scheduler.wait()
 
             # Process PyGame events
-            for event in pygame.event.get():
+            for event in pygame.event.get() if not self.headless else []:
                 if event.type == pygame.QUIT:
                     self.running = False
 
@@ -553,10 +1269,13 @@ class Agent:
                 if not self.message_queue.empty() and not self.audio_in_use:
                     print("Main thread: Found message in queue")
                     message = self.message_queue.get_nowait()
+                    self.lookahead_slots.release()
 
                     # Apply expression and play audio
+                    self.message = message
                     self.current_expression = message["expression"]
-                    self.audio_path = message["audio_file"]
+                    self.audio = message["audio"]
+                    self.lip_sync = message["lip_sync"]
 
                     print(
                         f"Main thread: Processing message with expression: {self.current_expression}"
@@ -565,65 +1284,36 @@ class Agent:
                     # Handle in main thread
                     self.model.SetExpression(self.current_expression)
 
-                    # Acquire mutex before accessing audio file
-                    with self.audio_mutex:
-                        try:
-                            pygame.mixer.music.load(self.audio_path)
-                            self.audio_in_use = True
-                            pygame.mixer.music.play()
-                            self.wav_handler.Start(self.audio_path)
-
-                            self.setup_ffmpeg(use_audio_file=True)
-                            print(f"Main thread: Playing audio {self.audio_path}")
-                        except Exception as e:
-                            print(f"Main thread: Error playing audio: {e}")
-                            self.audio_in_use = False
+                    # Every utterance plays through the encoder's audio
+                    # feed, streamed ones as their chunks arrive. The feed
+                    # is the clock for lip-sync and completion.
+                    self.audio_in_use = True
+                    self.audio_feed.play(self.audio.stream)
+                    print(f"Main thread: Playing audio {self.audio.id}")
 
             except queue.Empty:
                 pass
             except Exception as e:
                 print(f"Main thread: Error processing message: {e}")
 
+            # A streamed utterance can refine its expression while it plays
+            if self.message is not None and self.message["expression"] != self.current_expression:
+                self.current_expression = self.message["expression"]
+                print(f"Main thread: Expression changed to {self.current_expression}")
+                self.model.SetExpression(self.current_expression)
+
             # Update the model
             self.model.Update()
 
-            # Handle lip sync
-            if pygame.mixer.music.get_busy() and self.wav_handler.Update():
-                rms = self.wav_handler.GetRms()
-
-                for param_id in self.mouth_params:
-                    try:
-                        if "openy" in param_id.lower():
-                            self.model.SetParameterValue(
-                                param_id, rms * self.lip_sync_multiplier
-                            )
-                        elif "form" in param_id.lower():
-                            self.model.SetParameterValue(param_id, rms * 0.5)
-                    except Exception as e:
-                        pass
+            # Handle lip sync, the parameters of every frame were computed
+            # when the audio was synthesized
+            lip_sync = self.current_lip_sync()
+            if lip_sync is not None:
+                rms, values = lip_sync
 
-                if self.vowel_params:
+                for param_id, value in zip(self.lip_sync.param_ids, values):
                     try:
-                        if "ParamA" in self.vowel_params:
-                            self.model.SetParameterValue(
-                                "ParamA", rms * 3.0 if rms > 0.05 else 0
-                            )
-                        if "ParamO" in self.vowel_params:
-                            self.model.SetParameterValue(
-                                "ParamO", rms * 2.0 if 0.04 < rms < 0.15 else 0
-                            )
-                        if "ParamI" in self.vowel_params:
-                            self.model.SetParameterValue(
-                                "ParamI", rms * 1.0 if rms < 0.06 else 0
-                            )
-                        if "ParamU" in self.vowel_params:
-                            self.model.SetParameterValue(
-                                "ParamU", rms * 1.5 if 0.03 < rms < 0.1 else 0
-                            )
-                        if "ParamE" in self.vowel_params:
-                            self.model.SetParameterValue(
-                                "ParamE", rms * 1.0 if 0.03 < rms < 0.08 else 0
-                            )
+                        self.model.SetParameterValue(param_id, value)
                     except Exception as e:
                         pass
 
@@ -648,20 +1338,20 @@ class Agent:
                         pass
 
             # Check if audio finished playing
-            if self.audio_in_use and not pygame.mixer.music.get_busy():
+            if self.audio_in_use and not self.audio_playing():
                 # Audio finished playing
                 print("Main thread: Audio finished playing")
-                self.audio_in_use = False
-                self.audio_done.set()  # Signal that audio is done
+                self.finish_audio()
                 self.model.SetExpression("normal")
 
-                self.setup_ffmpeg(use_audio_file=False)
-
             self.model.SetOffset(self.dx, self.dy)
             self.model.SetScale(self.scale)
             # self.model.HitPart(100, 200, False)
             self.model.Drag(self.look_dx, self.look_dy)
 
+            if self.render_target is not None:
+                self.render_target.bind()
+
             # Change alpha to 1.0 instead of 0.0 (not transparent)
             live2d.clearBuffer(0.0, 0.0, 0.0, 1.0)
 
@@ -670,40 +1360,64 @@ class Agent:
                 self.model.Update()
             self.model.Draw()
 
-            pygame.display.flip()
+            if self.render_target is not self.output_target:
+                output_fbo = self.output_target.fbo if self.output_target else 0
+                self.render_target.blit_to(output_fbo, *self.display)
 
+            # Capture before the swap, the back buffer is undefined afterwards
             if self.ffmpeg_process is not None and self.ffmpeg_process.poll() is None:
-                try:
-                    # Ensure rendering is complete before capture
-                    glFinish()
-                    frame = capture_frame(self.display[0], self.display[1])
-                    self.ffmpeg_process.stdin.write(frame.tobytes())
-                except Exception as e:
-                    print(f"Error sending frame to ffmpeg: {e}")
-                    # If we encounter too many errors, restart ffmpeg
-                    if self.ffmpeg_error_count > 10:
-                        print("Too many ffmpeg errors, restarting the process")
-                        self.setup_ffmpeg(use_audio_file=self.audio_in_use)
-                        self.ffmpeg_error_count = 0
+                frame = self.frame_writer.acquire(repeat=1 + skipped_frames)
+                if frame is not None:
+                    try:
+                        if self.yuv_converter is not None:
+                            self.yuv_converter.convert(self.render_read_buffer)
+
+                        if self.frame_reader is not None:
+                            captured = self.frame_reader.read_into(frame)
+                        else:
+                            captured = capture_frame_into(
+                                self.display[0],
+                                self.display[1],
+                                frame,
+                                read_buffer=self.read_buffer,
+                                pix_fmt=self.pix_fmt,
+                            )
+                    except Exception as e:
+                        print(f"Error capturing frame: {e}")
+                        captured = False
+                    finally:
+                        if self.yuv_converter is not None:
+                            self.yuv_converter.finish()
+
+                    # Handed to the writer thread, the pipe write never
+                    # blocks the render loop
+                    if captured:
+                        self.frame_writer.submit(frame, repeat=1 + skipped_frames)
                     else:
-                        self.ffmpeg_error_count += 1
+                        self.frame_writer.discard(frame, repeat=1 + skipped_frames)
 
-            # FPS limiting
-            frame_end = time.time()
-            frame_time = frame_end - frame_start
-            target_frame_time = 1.0 / self.fps
+            # Also checked when ffmpeg is gone, e.g. after the RTMP
+            # connection dropped
+            self.check_ffmpeg()
 
-            if frame_time < target_frame_time:
-                time.sleep(target_frame_time - frame_time)
+            if not self.headless:
+                pygame.display.flip()
 
-            clock.tick(60)
+            if self.frame_scheduler.frames_rendered % (self.fps * 10) == 0:
+                print(f"Frame scheduler: {self.frame_scheduler.stats()}")
+                print(f"Frame writer: {self.frame_writer.stats()}")
+                print(f"Utterances ready: {self.message_queue.qsize()}/{self.lookahead}")
+                if self.repetition_guard is not None:
+                    print(f"Repetition guard: {self.repetition_guard.stats()}")
+                if self.output_fanout is not None:
+                    print(f"Output relays: {self.output_fanout.stats()}")
+                if self.tts_cache is not None:
+                    print(f"TTS cache: {self.tts_cache.stats()}")
+                if self.tts_pool is not None:
+                    print(f"TTS providers: {self.tts_pool.stats()}")
 
 
 if __name__ == "__main__":
-    from dotenv import load_dotenv
-
-    load_dotenv()
-
     os.environ["GEMINI_API_KEY"] = os.getenv("GEMINI_API_KEY")
     os.environ["ELEVENLABS_API_KEY"] = os.getenv("ELEVENLABS_API_KEY")
     os.environ["PLAY_HT_USER_ID"] = os.getenv("PLAY_HT_USER_ID")
@@ -727,5 +1441,20 @@ if __name__ == "__main__":
         background=False,
         speak=True,
         platform_chat=bool(os.environ["PLATFORM_CHAT"]),
+        headless=os.getenv("HEADLESS") == "1",
+        # Play utterances from their first TTS chunk and speak LLM output
+        # as it streams in, STREAM_SPEECH=0 waits for complete audio
+        stream_speech=os.getenv("STREAM_SPEECH", "1") == "1",
+        # Optional comma separated extra outputs (rtmp urls, .flv/.mp4 files,
+        # HLS directories) fed from the same encode
+        outputs=[os.environ["RTMP_URL"]]
+        + [target for target in os.getenv("EXTRA_OUTPUTS", "").split(",") if target],
+        # Optional comma separated TTS providers to fail over between,
+        # e.g. "elevenlabs,smallestai"
+        tts_providers=[
+            TTS_Options(name) for name in os.getenv("TTS_PROVIDERS", "").split(",") if name
+        ],
+        # Optional music bed looped under the voice
+        background_music=os.getenv("BACKGROUND_MUSIC"),
     )
     agt.run_agent()
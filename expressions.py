@@ -0,0 +1,118 @@
+import difflib
+import json
+import random
+import re
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+
+class Monologue(BaseModel):
+    """One utterance and the expression to show while speaking it"""
+
+    content: str = Field(description="Plain spoken text, at most 3 short lines")
+    expression: str = Field(description="Exact name of one of the given expressions")
+
+
+def resolve_expression(expression, expression_names):
+    """Map an LLM provided expression onto `expression_names`.
+
+    Exact names pass through; otherwise stray whitespace, quotes and case
+    are ignored, then the closest spelling is taken, and as a last resort a
+    random expression, so SetExpression never gets an unknown name.
+    """
+    if not expression_names:
+        return expression
+    if expression in expression_names:
+        return expression
+
+    cleaned = (expression or "").strip().strip("\"'`.").lower()
+    by_lower = {name.lower(): name for name in expression_names}
+    if cleaned in by_lower:
+        return by_lower[cleaned]
+
+    close = difflib.get_close_matches(cleaned, list(by_lower), n=1, cutoff=0.6)
+    if close:
+        return by_lower[close[0]]
+
+    fallback = random.choice(expression_names)
+    print(f"Unknown expression {expression!r}, using {fallback}")
+    return fallback
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class ExpressionClassifier:
+    """Picks an expression from the utterance text, locally on the CPU.
+
+    Every expression has a list of words and phrases in an editable JSON
+    lexicon. Terms are weighted by inverse document frequency over the
+    expressions (a term listed for several expressions says less), each
+    expression becomes one L2 normalized row of a weight matrix and a text
+    is scored with a single matrix-vector product over its sublinear term
+    counts. The confidence is the top expression's share of the total
+    score; no matching term at all gives the default with confidence 0.
+    """
+
+    def __init__(self, lexicon, expression_names, default="normal", min_confidence=0.45):
+        # Expressions the model does not have are never predicted
+        self.labels = [name for name in lexicon if name in expression_names]
+        self.default = default if default in expression_names else None
+        self.min_confidence = min_confidence
+
+        phrases = {}
+        for row, name in enumerate(self.labels):
+            for phrase in lexicon[name]:
+                phrases.setdefault(" ".join(tokenize(phrase)), set()).add(row)
+
+        self.vocabulary = {phrase: i for i, phrase in enumerate(phrases)}
+        self.max_ngram = max((len(phrase.split()) for phrase in phrases), default=1)
+
+        weights = np.zeros((len(self.labels), len(self.vocabulary)), dtype=np.float32)
+        for phrase, rows in phrases.items():
+            idf = np.log(1 + len(self.labels) / len(rows))
+            weights[list(rows), self.vocabulary[phrase]] = idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        self.weights = weights / np.maximum(norms, 1e-9)
+
+    @classmethod
+    def from_config(cls, path, expression_names):
+        with open(path, "r") as file:
+            config = json.load(file)
+        return cls(
+            config["expressions"],
+            expression_names,
+            default=config.get("default", "normal"),
+            min_confidence=config.get("min_confidence", 0.45),
+        )
+
+    def features(self, text):
+        counts = np.zeros(len(self.vocabulary), dtype=np.float32)
+        tokens = tokenize(text)
+        for n in range(1, self.max_ngram + 1):
+            for start in range(len(tokens) - n + 1):
+                index = self.vocabulary.get(" ".join(tokens[start : start + n]))
+                if index is not None:
+                    counts[index] += 1
+        return np.log1p(counts)
+
+    def classify(self, text):
+        """(expression, confidence in 0..1)"""
+        if not self.labels:
+            return self.default, 0.0
+
+        scores = self.weights @ self.features(text)
+        total = scores.sum()
+        if total <= 0:
+            return self.default, 0.0
+
+        best = int(np.argmax(scores))
+        return self.labels[best], float(scores[best] / total)
+
+    def is_confident(self, confidence):
+        return confidence >= self.min_confidence
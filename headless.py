@@ -0,0 +1,67 @@
+import ctypes
+
+from OpenGL import EGL
+from OpenGL.GL import *
+
+
+class EGLContext:
+    """Window-less OpenGL context created through EGL.
+
+    PyOpenGL must be loaded with PYOPENGL_PLATFORM=egl (engine.py sets it
+    when HEADLESS=1) so GL calls resolve against the EGL context instead of
+    GLX. No X server, window or swap chain is involved: the context only
+    owns a 1x1 pbuffer and all rendering goes to an OffscreenTarget
+    (capture.py).
+    """
+
+    def __init__(self):
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if self.display == EGL.EGL_NO_DISPLAY:
+            raise RuntimeError("No EGL display available")
+
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("Unable to initialize EGL")
+        print(f"EGL initialized: {major.value}.{minor.value}")
+
+        config_attribs = (EGL.EGLint * 15)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RED_SIZE, 8,
+            EGL.EGL_GREEN_SIZE, 8,
+            EGL.EGL_BLUE_SIZE, 8,
+            EGL.EGL_ALPHA_SIZE, 8,
+            EGL.EGL_STENCIL_SIZE, 8,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE,
+        )
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        if not EGL.eglChooseConfig(
+            self.display, config_attribs, ctypes.pointer(config), 1, ctypes.pointer(num_configs)
+        ) or num_configs.value == 0:
+            raise RuntimeError("No matching EGL config")
+
+        surface_attribs = (EGL.EGLint * 5)(EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1, EGL.EGL_NONE)
+        self.surface = EGL.eglCreatePbufferSurface(self.display, config, surface_attribs)
+        if self.surface == EGL.EGL_NO_SURFACE:
+            raise RuntimeError("Unable to create EGL pbuffer surface")
+
+        # Desktop GL (compatibility profile), which is what live2d expects
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, None)
+        if self.context == EGL.EGL_NO_CONTEXT:
+            raise RuntimeError("Unable to create EGL context")
+
+        self.make_current()
+
+    def make_current(self):
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context):
+            raise RuntimeError("Unable to make EGL context current")
+
+    def release(self):
+        EGL.eglMakeCurrent(
+            self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT
+        )
+        EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
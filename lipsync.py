@@ -0,0 +1,158 @@
+import threading
+
+import numpy as np
+
+from audio import AUDIO_SAMPLE_RATE
+from visemes import VOWEL_FORMANTS, vowel_weights
+
+# Vowel parameter: (gain, rms lower bound, rms upper bound), both exclusive
+VOWEL_RULES = {
+    "ParamA": (3.0, 0.05, np.inf),
+    "ParamO": (2.0, 0.04, 0.15),
+    "ParamI": (1.0, -np.inf, 0.06),
+    "ParamU": (1.5, 0.03, 0.1),
+    "ParamE": (1.0, 0.03, 0.08),
+}
+
+
+def frame_edges(first_frame, count, sample_rate, fps):
+    """Sample offsets of the boundaries of `count` video frames"""
+    frames = np.arange(first_frame, first_frame + count + 1)
+    return np.round(frames * (sample_rate / fps)).astype(np.int64)
+
+
+def frame_rms(samples, edges):
+    """RMS (0..1) of int16 (frames, channels) PCM between every pair of
+    consecutive `edges`, relative to the start of `samples`"""
+    power = np.mean((samples.astype(np.float64) / 32768) ** 2, axis=1)
+    cumulative = np.concatenate([[0.0], np.cumsum(power)])
+    lengths = np.maximum(edges[1:] - edges[:-1], 1)
+    return np.sqrt((cumulative[edges[1:]] - cumulative[edges[:-1]]) / lengths)
+
+
+def mouth_values(rms, mouth_params, vowel_params, multiplier=10.0, weights=None):
+    """Parameter ids and the (frames, params) matrix of their values for an
+    RMS envelope, the mouth open/form and vowel mapping in one pass.
+
+    With spectral `weights` (see visemes.vowel_weights) the vowel shapes
+    follow the estimated vowel, scaled by how open the mouth is, instead of
+    the RMS thresholds of VOWEL_RULES.
+    """
+    param_ids = []
+    columns = []
+
+    for param_id in mouth_params:
+        if "openy" in param_id.lower():
+            param_ids.append(param_id)
+            columns.append(rms * multiplier)
+        elif "form" in param_id.lower():
+            param_ids.append(param_id)
+            columns.append(rms * 0.5)
+
+    if weights is not None:
+        openness = np.clip(rms * multiplier, 0.0, 1.0)
+        for i, param_id in enumerate(VOWEL_FORMANTS):
+            if param_id in vowel_params:
+                param_ids.append(param_id)
+                columns.append(weights[:, i] * openness)
+    else:
+        for param_id, (gain, low, high) in VOWEL_RULES.items():
+            if param_id in vowel_params:
+                param_ids.append(param_id)
+                columns.append(np.where((rms > low) & (rms < high), rms * gain, 0.0))
+
+    values = np.stack(columns, axis=1) if columns else np.zeros((len(rms), 0))
+    return param_ids, values.astype(np.float32)
+
+
+class LipSyncTrack:
+    """Per video frame mouth parameters of one utterance.
+
+    The envelope is computed with NumPy over whole blocks of audio, ahead of
+    playback, and the render loop only looks up the row for the current
+    playback position. An utterance that is still streaming (PCMStream) is
+    extended on the producer's thread as its chunks are appended, nothing
+    is analyzed on lookup. With `spectral` the vowel shapes come from the
+    formant analysis of visemes.py.
+    """
+
+    def __init__(
+        self,
+        stream,
+        mouth_params,
+        vowel_params,
+        fps,
+        multiplier=10.0,
+        sample_rate=AUDIO_SAMPLE_RATE,
+        spectral=True,
+    ):
+        self.stream = stream
+        self.mouth_params = mouth_params
+        self.vowel_params = vowel_params
+        self.fps = fps
+        self.multiplier = multiplier
+        self.sample_rate = sample_rate
+        self.spectral = spectral
+
+        self.param_ids, values = mouth_values(
+            np.zeros(0),
+            mouth_params,
+            vowel_params,
+            multiplier,
+            np.zeros((0, len(VOWEL_FORMANTS))) if spectral else None,
+        )
+        # (rms, values) replaced as a whole, lookups never see a half update
+        self.rows = (np.zeros(0, dtype=np.float32), values)
+        self.update_lock = threading.Lock()
+        self.update()
+        stream.subscribe(self.update)
+
+    def update(self):
+        """Compute the frames whose audio is available, returns their count"""
+        with self.update_lock:
+            return self.update_locked()
+
+    def update_locked(self):
+        available = len(self.stream)
+        rms_rows, value_rows = self.rows
+        first = len(rms_rows)
+        count = int(available * self.fps // self.sample_rate) - first
+        covered = frame_edges(first + count, 0, self.sample_rate, self.fps)[0]
+        if self.stream.finished and covered < available:
+            # Trailing partial frame of a complete utterance
+            count += 1
+        if count <= 0:
+            return 0
+
+        edges = frame_edges(first, count, self.sample_rate, self.fps)
+        edges[-1] = min(edges[-1], available)
+        samples = self.stream.read(edges[0], edges[-1] - edges[0])
+        edges = edges - edges[0]
+        rms = frame_rms(samples, edges).astype(np.float32)
+        weights = vowel_weights(samples, edges, self.sample_rate) if self.spectral else None
+
+        _, values = mouth_values(
+            rms, self.mouth_params, self.vowel_params, self.multiplier, weights
+        )
+        self.rows = (
+            np.concatenate([rms_rows, rms]),
+            np.concatenate([value_rows, values]),
+        )
+        return count
+
+    def frame(self, index):
+        """(rms, parameter values) of video frame `index`, None past the end.
+
+        While the audio is still arriving a frame not analyzed yet gets the
+        latest row.
+        """
+        rms, values = self.rows
+        if index >= len(rms):
+            if self.stream.finished or not len(rms):
+                return None
+            index = len(rms) - 1
+        return float(rms[index]), values[index].tolist()
+
+    def at(self, position):
+        """Row for the playback position `position`, in samples"""
+        return self.frame(int(position * self.fps // self.sample_rate))
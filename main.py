@@ -3,25 +3,21 @@ import pygame
 from pygame.locals import *
 import live2d.v3 as live2d
 from live2d.utils import log
-from live2d.utils.lipsync import WavHandler
 from OpenGL.GL import *
 import numpy as np
 import subprocess
 import time
-import tempfile
-import shutil
 import wave
 import json
 
+from audio import AUDIO_CHANNELS, AUDIO_SAMPLE_RATE, AudioTimeline, PCMStream
+from capture import capture_frame_into, frame_view
+from lipsync import LipSyncTrack
+
 width, height = 1000, 1400
 fps = 30
-temp_dir = tempfile.mkdtemp()
-frames_dir = os.path.join(temp_dir, "frames")
-audio_dir = os.path.join(temp_dir, "audio")
-os.makedirs(frames_dir, exist_ok=True)
-os.makedirs(audio_dir, exist_ok=True)
 output_filename = "expression_showcase.mp4"
-audio_config_file = os.path.join(temp_dir, "audio_config.json")
+audio_config_file = "expression_showcase_audio.json"
 
 def get_audio_duration(audio_file):
     """Get the duration of an audio file in seconds"""
@@ -31,95 +27,47 @@ def get_audio_duration(audio_file):
         duration = frames / float(rate)
         return duration
 
-def capture_frame():
-    """Capture the current OpenGL frame"""
-    glReadBuffer(GL_FRONT)
-    pixels = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
-    image = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)
-    image = np.flipud(image)  # OpenGL has origin at bottom left
-    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # Convert to BGR for OpenCV
+def start_encoder(output_filename, fps):
+    """Start a single ffmpeg pass encoding piped frames and piped audio"""
+    audio_read_fd, audio_write_fd = os.pipe()
+    cmd = [
+        'ffmpeg',
+        '-y',
+        # Raw frames straight from OpenGL, bottom-up
+        '-thread_queue_size', '512',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'bgr24',
+        '-s', f'{width}x{height}',
+        '-r', str(fps),
+        '-i', '-',
+        # Mixed audio, written in lockstep with the frames
+        '-thread_queue_size', '512',
+        '-f', 's16le',
+        '-ar', str(AUDIO_SAMPLE_RATE),
+        '-ac', str(AUDIO_CHANNELS),
+        '-i', f'pipe:{audio_read_fd}',
+        '-vf', 'vflip',
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-b:a', '128k',
+        output_filename
+    ]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, pass_fds=(audio_read_fd,))
+    os.close(audio_read_fd)
+    return process, audio_write_fd
 
-def create_video_with_multiple_audio(frames_dir, audio_config, output_filename, fps):
-    """Create video with multiple audio sources at specific times"""
-    try:
-        # First create a video without audio
-        temp_video = os.path.join(temp_dir, "temp_video_no_audio.mp4")
-        cmd = [
-            'ffmpeg', 
-            '-y',
-            '-framerate', str(fps), 
-            '-i', os.path.join(frames_dir, 'frame_%05d.png'), 
-            '-c:v', 'libx264', 
-            '-pix_fmt', 'yuv420p', 
-            temp_video
-        ]
-        subprocess.run(cmd, check=True)
-        
-        # Create a file with timing information for complex filtering
-        filter_file = os.path.join(temp_dir, "filter_complex.txt")
-        
-        # Start building the complex filter
-        filter_parts = []
-        input_count = 1  # Start after the video input
-        
-        # For each audio segment
-        for idx, audio_segment in enumerate(audio_config):
-            segment_file = audio_segment['file']
-            start_time = audio_segment['start_time']
-            
-            # Add input for this segment
-            filter_parts.append(f"[{input_count}:a]adelay={int(start_time*1000)}|{int(start_time*1000)}[a{idx}]")
-            input_count += 1
-        
-        # Mix all audio segments
-        if audio_config:
-            # Create the mix command
-            mix_inputs = ''.join(f'[a{i}]' for i in range(len(audio_config)))
-            filter_parts.append(f"{mix_inputs}amix=inputs={len(audio_config)}:duration=longest[aout]")
-            
-            # Write to filter file
-            with open(filter_file, 'w') as f:
-                f.write(";\n".join(filter_parts))
-            
-            # Build input arguments for all audio files
-            input_args = []
-            for segment in audio_config:
-                input_args.extend(['-i', segment['file']])
-            
-            # Final command to combine video with all audio segments
-            cmd = [
-                'ffmpeg',
-                '-y',
-                '-i', temp_video
-            ] + input_args + [
-                '-filter_complex_script', filter_file,
-                '-map', '0:v',
-                '-map', '[aout]',
-                '-c:v', 'copy',
-                '-c:a', 'aac',
-                output_filename
-            ]
-            subprocess.run(cmd, check=True)
-            print(f"Successfully created video with multiple audio tracks: {output_filename}")
-        else:
-            # No audio, just copy the video
-            shutil.copy(temp_video, output_filename)
-            print(f"Created video with no audio: {output_filename}")
-            
-    except subprocess.CalledProcessError as e:
-        print(f"Error during FFmpeg processing: {e}")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
+def write_all(fd, data):
+    view = memoryview(data).cast('B')
+    while len(view):
+        view = view[os.write(fd, view):]
 
 def main():
     pygame.init()
     pygame.mixer.init()
     live2d.init()
 
-    # Import cv2 here to avoid any startup issues
-    global cv2
-    import cv2
-
     display = (width, height)
     pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
     pygame.display.set_caption("Live2D Viewer")
@@ -138,9 +86,9 @@ def main():
     audio_duration = get_audio_duration(audio_path)
     print(f"Audio duration: {audio_duration:.2f} seconds")
 
-    wav_handler = WavHandler()
     lip_sync_multiplier = 10.0
-    lip_sync_active = False
+    lip_sync = None
+    lip_sync_start_frame = 0
 
     # Keep track of audio segments and their start times
     audio_segments = []
@@ -184,13 +132,15 @@ def main():
     print("- Drag: Move the model")
     print("- ESC: Stop recording and exit")
     
-    # Prepare for recording
+    # Prepare for recording, frames and audio go straight into one encoder
     frame_count = 0
     recording_active = True
     clock = pygame.time.Clock()
     start_time = time.time()
-    
-    wav_instance_count = 0  # To track multiple instances of the same audio
+    encoder, audio_fd = start_encoder(output_filename, fps)
+    # Segments are mixed into one in-memory PCM track as they start
+    audio_timeline = AudioTimeline()
+    frame = np.empty((height, width, 3), dtype=np.uint8)
 
     while running:
         for event in pygame.event.get():
@@ -238,16 +188,15 @@ def main():
                     # Calculate the time for this audio segment
                     current_time = frame_count / fps
                     
-                    # Create a copy of the audio file for this instance
-                    wav_instance_count += 1
-                    audio_instance = os.path.join(audio_dir, f"audio_{wav_instance_count}.wav")
-                    shutil.copy(audio_path, audio_instance)
-                    
-                    # Record this audio segment
+                    # Record this audio segment and mix it into the
+                    # timeline, the WAV itself is only decoded once
+                    start_sample = frame_count * AUDIO_SAMPLE_RATE // fps
+                    audio_timeline.add(audio_path, start_sample)
                     audio_segments.append({
-                        'file': audio_instance,
+                        'file': audio_path,
                         'start_time': current_time,
                         'start_frame': frame_count,
+                        'start_sample': start_sample,
                         'duration': audio_duration
                     })
                     
@@ -255,10 +204,16 @@ def main():
                     pygame.mixer.music.load(audio_path)
                     pygame.mixer.music.play()
                     
-                    # Start lip sync
-                    wav_handler = WavHandler()  # Create a new instance to start fresh
-                    wav_handler.Start(audio_path)
-                    lip_sync_active = True
+                    # Start lip sync, indexed by recorded frame so a
+                    # re-render produces exactly the same mouth movement
+                    lip_sync = LipSyncTrack(
+                        PCMStream.from_samples(audio_timeline.decode(audio_path)),
+                        mouth_params,
+                        vowel_params,
+                        fps,
+                        lip_sync_multiplier,
+                    )
+                    lip_sync_start_frame = frame_count
                     
                     print(f"Started lip sync with audio at frame {frame_count} (time: {current_time:.2f}s)")
                     
@@ -271,30 +226,12 @@ def main():
 
         model.Update()
 
-        if lip_sync_active and pygame.mixer.music.get_busy() and wav_handler.Update():
-            rms = wav_handler.GetRms()
-
-            for param_id in mouth_params:
+        lip_sync_frame = lip_sync.frame(frame_count - lip_sync_start_frame) if lip_sync else None
+        if lip_sync_frame is not None:
+            _, values = lip_sync_frame
+            for param_id, value in zip(lip_sync.param_ids, values):
                 try:
-                    if "openy" in param_id.lower():
-                        model.AddParameterValue(param_id, rms * lip_sync_multiplier)
-                    elif "form" in param_id.lower():
-                        model.AddParameterValue(param_id, rms * 0.5)
-                except Exception as e:
-                    pass
-
-            if vowel_params:
-                try:
-                    if "ParamA" in vowel_params:
-                        model.AddParameterValue("ParamA", rms * 3.0 if rms > 0.05 else 0)
-                    if "ParamO" in vowel_params:
-                        model.AddParameterValue("ParamO", rms * 2.0 if 0.04 < rms < 0.15 else 0)
-                    if "ParamI" in vowel_params:
-                        model.AddParameterValue("ParamI", rms * 1.0 if rms < 0.06 else 0)
-                    if "ParamU" in vowel_params:
-                        model.AddParameterValue("ParamU", rms * 1.5 if 0.03 < rms < 0.1 else 0)
-                    if "ParamE" in vowel_params:
-                        model.AddParameterValue("ParamE", rms * 1.0 if 0.03 < rms < 0.08 else 0)
+                    model.AddParameterValue(param_id, value)
                 except Exception as e:
                     pass
 
@@ -311,11 +248,17 @@ def main():
         live2d.clearBuffer(0.0, 0.0, 0.0, 0.0)
         model.Draw()
 
-        # Always capture frames for the recording
+        # Always capture frames for the recording, before the buffer swap
         if recording_active:
-            frame = capture_frame()
-            frame_path = os.path.join(frames_dir, f'frame_{frame_count:05d}.png')
-            cv2.imwrite(frame_path, frame)
+            capture_frame_into(width, height, frame)
+            try:
+                encoder.stdin.write(frame_view(frame))
+                frame_start = frame_count * AUDIO_SAMPLE_RATE // fps
+                frame_end = (frame_count + 1) * AUDIO_SAMPLE_RATE // fps
+                write_all(audio_fd, audio_timeline.read(frame_start, frame_end - frame_start))
+            except OSError as e:
+                print(f"Encoder stopped accepting data: {e}")
+                running = False
             frame_count += 1
             
             if frame_count % fps == 0:
@@ -335,24 +278,19 @@ def main():
         clock.tick(fps)
 
     print(f"Captured {frame_count} frames ({frame_count/fps:.1f} seconds)")
-    
-    if frame_count > 0 and audio_segments:
+
+    # Closing both pipes lets ffmpeg finish the file, no second pass needed
+    os.close(audio_fd)
+    encoder.stdin.close()
+    encoder.wait()
+
+    if audio_segments:
         # Save audio configuration for debugging
         with open(audio_config_file, 'w') as f:
             json.dump(audio_segments, f, indent=2)
-        
-        # Create the final video with multiple audio segments
-        print("Creating final video with multiple audio segments...")
-        create_video_with_multiple_audio(frames_dir, audio_segments, output_filename, fps)
+        print(f"Created video with {len(audio_segments)} audio segments: {output_filename}")
     else:
-        print("No frames or audio recorded. Did you press L during the session?")
-    
-    # Clean up temp files
-    try:
-        shutil.rmtree(temp_dir)
-        print(f"Cleaned up temporary files")
-    except Exception as e:
-        print(f"Warning: Could not clean up temp directory: {e}")
+        print(f"Created video with no audio: {output_filename}")
     
     live2d.dispose()
     pygame.quit()
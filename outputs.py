@@ -0,0 +1,334 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+
+
+def is_network_output(target):
+    return target.startswith(("rtmp://", "rtmps://", "srt://"))
+
+
+def muxer_options(target):
+    """Muxer name and tee slave options for a local output target"""
+    lower = target.lower()
+    if lower.endswith(".flv"):
+        return "flv", {}
+    if lower.endswith(".mp4"):
+        # Fragmented so the archive stays playable if the process dies
+        return "mp4", {"movflags": "+frag_keyframe+empty_moov"}
+    if lower.endswith(".m3u8"):
+        return "hls", {"hls_time": "4", "hls_list_size": "0"}
+    raise ValueError(f"Unsupported output target: {target}")
+
+
+def local_output_path(target):
+    """HLS outputs can be given as a directory, the playlist goes inside"""
+    if target.endswith("/") or os.path.isdir(target):
+        os.makedirs(target, exist_ok=True)
+        return os.path.join(target, "index.m3u8")
+    return target
+
+
+def build_output_args(outputs, relay_fd=None):
+    """ffmpeg output arguments for one encode written to every output.
+
+    A single output is muxed directly. Several outputs go through the tee
+    muxer: local files are tee slaves, network destinations share one
+    MPEG-TS slave written to `relay_fd` and are pushed by OutputRelay
+    processes, so a failing endpoint can reconnect on its own without
+    touching the encoder or the other outputs.
+    """
+    if len(outputs) == 1:
+        target = outputs[0]
+        if is_network_output(target):
+            return ["-f", "flv", target]
+        target = local_output_path(target)
+        muxer, options = muxer_options(target)
+        args = ["-f", muxer]
+        for key, value in options.items():
+            args.extend([f"-{key}", value])
+        return args + [target]
+
+    slaves = []
+    for target in outputs:
+        if is_network_output(target):
+            continue
+        target = local_output_path(target)
+        muxer, options = muxer_options(target)
+        options = ":".join(f"{key}={value}" for key, value in options.items())
+        options = f":{options}" if options else ""
+        slaves.append(f"[f={muxer}{options}:onfail=ignore]{target}")
+
+    if relay_fd is not None:
+        # Global headers are on for the tee, put SPS/PPS back in-band so a
+        # relay can join the transport stream at any keyframe
+        slaves.append(f"[f=mpegts:bsfs/v=dump_extra:onfail=ignore]pipe:{relay_fd}")
+
+    return ["-flags", "+global_header", "-f", "tee", "|".join(slaves)]
+
+
+class OutputRelay:
+    """Pushes the shared MPEG-TS stream to one network destination.
+
+    Runs its own `ffmpeg -c copy` process, fed from a bounded chunk queue,
+    and respawns it with a backoff whenever it exits. When the destination
+    is slow the oldest chunks are dropped, other outputs are unaffected.
+    """
+
+    def __init__(self, url, max_chunks=256, retry_delay=2.0, max_retry_delay=30.0):
+        self.url = url
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.process = None
+        self.running = False
+        self.thread = None
+
+        self.restarts = 0
+        self.chunks_dropped = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.relay_worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.process is not None:
+            self.process.terminate()
+
+    def feed(self, chunk):
+        try:
+            self.chunks.put_nowait(chunk)
+        except queue.Full:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                pass
+            self.chunks_dropped += 1
+            self.chunks.put_nowait(chunk)
+
+    def spawn(self):
+        cmd = [
+            "ffmpeg",
+            "-loglevel",
+            "warning",
+            "-f",
+            "mpegts",
+            "-i",
+            "-",
+            "-c",
+            "copy",
+            "-f",
+            "flv",
+            self.url,
+        ]
+        print(f"Output relay: connecting to {self.url}")
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def relay_worker(self):
+        delay = self.retry_delay
+
+        while self.running:
+            self.process = self.spawn()
+            started = time.monotonic()
+
+            while self.running and self.process.poll() is None:
+                try:
+                    chunk = self.chunks.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    self.process.stdin.write(chunk)
+                except Exception as e:
+                    print(f"Output relay {self.url}: write failed: {e}")
+                    break
+
+            if not self.running:
+                break
+
+            self.process.kill()
+            self.restarts += 1
+
+            # Reset the backoff once a connection held for a while
+            if time.monotonic() - started > self.max_retry_delay:
+                delay = self.retry_delay
+            print(f"Output relay {self.url}: disconnected, retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+            # Stale data would only delay the reconnect
+            while not self.chunks.empty():
+                try:
+                    self.chunks.get_nowait()
+                except queue.Empty:
+                    break
+
+
+class OutputFanout:
+    """Reads the encoder's MPEG-TS pipe and feeds every OutputRelay"""
+
+    def __init__(self, urls):
+        self.relays = [OutputRelay(url) for url in urls]
+        self.lock = threading.Lock()
+        self.fd = None
+        self.running = False
+        self.thread = None
+
+    def attach(self, fd):
+        """Switch input to a new pipe, used when ffmpeg is (re)started"""
+        with self.lock:
+            old_fd, self.fd = self.fd, fd
+        if old_fd is not None:
+            try:
+                os.close(old_fd)
+            except OSError:
+                pass
+
+    def start(self):
+        for relay in self.relays:
+            relay.start()
+        self.running = True
+        self.thread = threading.Thread(target=self.fanout_worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        for relay in self.relays:
+            relay.stop()
+        self.attach(None)
+
+    def stats(self):
+        return {
+            relay.url: {"restarts": relay.restarts, "dropped": relay.chunks_dropped}
+            for relay in self.relays
+        }
+
+    def fanout_worker(self):
+        while self.running:
+            fd = self.fd
+            if fd is None:
+                time.sleep(0.1)
+                continue
+
+            try:
+                chunk = os.read(fd, 188 * 348)
+            except OSError:
+                chunk = b""
+
+            if not chunk:
+                # Encoder closed the pipe, wait for the next attach
+                if fd == self.fd:
+                    time.sleep(0.1)
+                continue
+
+            for relay in self.relays:
+                relay.feed(chunk)
+
+
+# (height, video bitrate in kbps) of every rendition, highest first
+DEFAULT_ABR_LADDER = [(1080, 4500), (720, 2500), (480, 1000)]
+
+
+def build_abr_args(
+    renditions, output_dir, fps, vflip=True, abr_format="hls", audio_bitrate="128k"
+):
+    """ffmpeg arguments encoding the captured stream into an ABR ladder.
+
+    The single piped input is split and scaled inside one filter graph,
+    each rendition gets its own x264 encode and the result is written as
+    HLS variants with a master playlist (or a DASH manifest). Keyframes are
+    aligned across renditions so players can switch at segment borders.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    count = len(renditions)
+    gop = str(fps * 2)
+
+    head = "vflip," if vflip else ""
+    graph = [f"[0:v]{head}split={count}" + "".join(f"[v{i}]" for i in range(count))]
+    for i, (height, _) in enumerate(renditions):
+        graph.append(f"[v{i}]scale=-2:{height}[v{i}out]")
+
+    args = ["-filter_complex", ";".join(graph)]
+
+    for i, (_, bitrate) in enumerate(renditions):
+        args.extend(
+            [
+                "-map",
+                f"[v{i}out]",
+                f"-c:v:{i}",
+                "libx264",
+                f"-b:v:{i}",
+                f"{bitrate}k",
+                f"-maxrate:v:{i}",
+                f"{bitrate}k",
+                f"-bufsize:v:{i}",
+                f"{bitrate * 2}k",
+            ]
+        )
+
+    # HLS variants each carry their own audio, DASH shares one adaptation set
+    audio_maps = count if abr_format == "hls" else 1
+    for _ in range(audio_maps):
+        args.extend(["-map", "1:a"])
+
+    args.extend(
+        [
+            "-pix_fmt",
+            "yuv420p",
+            "-preset",
+            "ultrafast",
+            "-tune",
+            "zerolatency",
+            "-g",
+            gop,
+            "-keyint_min",
+            gop,
+            "-sc_threshold",
+            "0",
+            "-c:a",
+            "aac",
+            "-b:a",
+            audio_bitrate,
+        ]
+    )
+
+    if abr_format == "hls":
+        var_stream_map = " ".join(f"v:{i},a:{i}" for i in range(count))
+        return args + [
+            "-f",
+            "hls",
+            "-hls_time",
+            "4",
+            "-hls_list_size",
+            "6",
+            "-hls_flags",
+            "delete_segments+independent_segments",
+            "-master_pl_name",
+            "master.m3u8",
+            "-var_stream_map",
+            var_stream_map,
+            "-hls_segment_filename",
+            os.path.join(output_dir, "%v", "segment_%05d.ts"),
+            os.path.join(output_dir, "%v", "index.m3u8"),
+        ]
+
+    if abr_format == "dash":
+        return args + [
+            "-f",
+            "dash",
+            "-seg_duration",
+            "4",
+            "-window_size",
+            "6",
+            "-streaming",
+            "1",
+            "-adaptation_sets",
+            "id=0,streams=v id=1,streams=a",
+            os.path.join(output_dir, "manifest.mpd"),
+        ]
+
+    raise ValueError(f"Unsupported ABR format: {abr_format}")
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+import time
+
+import numpy as np
+
+MERSENNE_PRIME = (1 << 31) - 1
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def shingles(text, size=2):
+    """Word n-grams of the normalized text, the whole text if shorter"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def shingle_hashes(text, size=2):
+    """Stable 31 bit hashes of the shingles, the same across restarts"""
+    return np.array(
+        [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            % MERSENNE_PRIME
+            for shingle in shingles(text, size)
+        ],
+        dtype=np.uint64,
+    )
+
+
+class RepetitionGuard:
+    """MinHash index of the most recently spoken lines.
+
+    Each line is reduced to a `num_perm` value MinHash signature over its
+    word shingles; the fraction of equal values estimates the Jaccard
+    similarity of two lines. Signatures live in a fixed ring of `capacity`
+    slots (bounded memory, the oldest line is forgotten first) and are
+    bucketed by LSH bands, so a lookup only compares against lines that
+    share at least one band. The ring is saved to `path` every
+    `save_every` adds or `save_interval` seconds, and by flush(), and
+    loaded again on start.
+    """
+
+    def __init__(
+        self,
+        path="repetition_index.npz",
+        capacity=5000,
+        num_perm=64,
+        bands=16,
+        threshold=0.6,
+        seed=1,
+        save_every=20,
+        save_interval=60.0,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+
+        # Fixed seed, signatures stay comparable across restarts
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+        self.signatures = np.zeros((capacity, num_perm), dtype=np.uint32)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.next_slot = 0
+        self.buckets = {}
+
+        self.checks = 0
+        self.rejected = 0
+
+        self.load()
+
+    def signature(self, text):
+        hashes = shingle_hashes(text)
+        values = (hashes[:, None] * self.a[None, :] + self.b[None, :]) % MERSENNE_PRIME
+        return values.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature):
+        return [
+            (band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def similarity(self, text):
+        """Highest estimated Jaccard similarity to an indexed line"""
+        signature = self.signature(text)
+        candidates = set()
+        for key in self.band_keys(signature):
+            candidates |= self.buckets.get(key, set())
+        if not candidates:
+            return 0.0
+
+        slots = np.fromiter(candidates, dtype=np.int64)
+        matches = (self.signatures[slots] == signature[None, :]).mean(axis=1)
+        return float(matches.max())
+
+    def is_repetition(self, text):
+        self.checks += 1
+        similarity = self.similarity(text)
+        if similarity >= self.threshold:
+            self.rejected += 1
+            print(f"Repetition guard: {similarity:.2f} similar to a recent line")
+            return True
+        return False
+
+    def add(self, text):
+        slot = self.next_slot
+        if self.used[slot]:
+            self.unindex(slot)
+
+        self.signatures[slot] = self.signature(text)
+        self.used[slot] = True
+        self.index(slot)
+        self.next_slot = (slot + 1) % self.capacity
+
+        self.unsaved += 1
+        if (
+            self.unsaved >= self.save_every
+            or time.monotonic() - self.saved_at >= self.save_interval
+        ):
+            self.save()
+
+    def index(self, slot):
+        for key in self.band_keys(self.signatures[slot]):
+            self.buckets.setdefault(key, set()).add(slot)
+
+    def unindex(self, slot):
+        for key in self.band_keys(self.signatures[slot]):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del self.buckets[key]
+
+    def flush(self):
+        """Save the lines added since the last save"""
+        if self.unsaved:
+            self.save()
+
+    def save(self):
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+        if self.path is None:
+            return
+        temp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            temp_path,
+            signatures=self.signatures,
+            used=self.used,
+            next_slot=self.next_slot,
+        )
+        os.replace(temp_path, self.path)
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path)
+            signatures, used = data["signatures"], data["used"]
+            next_slot = int(data["next_slot"])
+        except Exception as e:
+            print(f"Repetition guard: unable to load {self.path}: {e}")
+            return
+        if signatures.shape[1] != self.num_perm:
+            print("Repetition guard: index built with other settings, starting fresh")
+            return
+
+        # Keep the newest lines when the capacity changed
+        order = np.roll(np.arange(len(used)), -next_slot)
+        order = order[used[order]][-self.capacity :]
+        count = len(order)
+        self.signatures[:count] = signatures[order]
+        self.used[:count] = True
+        self.next_slot = count % self.capacity
+        for slot in range(count):
+            self.index(slot)
+
+    def stats(self):
+        return {
+            "lines": int(self.used.sum()),
+            "checks": self.checks,
+            "rejected": self.rejected,
+        }
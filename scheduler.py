@@ -0,0 +1,76 @@
+import time
+from collections import deque
+
+import numpy as np
+
+
+class FrameScheduler:
+    """Frame pacing on a monotonic deadline grid.
+
+    Slot i is due at start + i / fps, computed from the slot index rather
+    than accumulated, so rounding never drifts the output rate away from
+    the `-r` given to ffmpeg. A frame that starts late is caught up by not
+    sleeping; once the loop is more than `max_catch_up` slots behind, the
+    missed slots are skipped and reported to the caller, which fills them
+    by repeating the last frame so frame count still matches wall time.
+    """
+
+    def __init__(self, fps, max_catch_up=3, late_tolerance=0.002, history=1000):
+        self.fps = fps
+        self.interval = 1.0 / fps
+        self.max_catch_up = max_catch_up
+        self.late_tolerance = late_tolerance
+        self.lateness = deque(maxlen=history)
+
+        self.start_time = None
+        self.slot = 0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+        self.late_frames = 0
+
+    def reset(self):
+        self.start_time = time.monotonic()
+        self.slot = 0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+        self.late_frames = 0
+        self.lateness.clear()
+
+    def wait(self):
+        """Block until the next frame slot, returns how many slots were skipped"""
+        if self.start_time is None:
+            self.reset()
+
+        deadline = self.start_time + self.slot * self.interval
+        now = time.monotonic()
+        if now < deadline:
+            time.sleep(deadline - now)
+            now = time.monotonic()
+
+        lateness = now - deadline
+        self.lateness.append(lateness)
+        if lateness > self.late_tolerance:
+            self.late_frames += 1
+
+        skipped = 0
+        if lateness > self.max_catch_up * self.interval:
+            skipped = int(lateness / self.interval)
+            self.frames_skipped += skipped
+
+        self.frames_rendered += 1
+        self.slot += 1 + skipped
+        return skipped
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start_time if self.start_time else 0.0
+        lateness_ms = np.array(self.lateness) * 1000 if self.lateness else np.zeros(1)
+        p50, p95, p99 = np.percentile(lateness_ms, [50, 95, 99])
+        return {
+            "fps": self.frames_rendered / elapsed if elapsed > 0 else 0.0,
+            "frames": self.frames_rendered,
+            "skipped": self.frames_skipped,
+            "late": self.late_frames,
+            "jitter_p50_ms": round(float(p50), 2),
+            "jitter_p95_ms": round(float(p95), 2),
+            "jitter_p99_ms": round(float(p99), 2),
+        }
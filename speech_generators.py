@@ -2,12 +2,14 @@ from smallest import Smallest
 from elevenlabs import ElevenLabs, save
 
 from pyht import Client
-from pyht.client import TTSOptions
+from pyht.client import Format, TTSOptions
 
+# Raw 16 bit mono PCM rates of the streaming generators
+ELEVENLABS_STREAM_SAMPLE_RATE = 22050
+PLAYHT_STREAM_SAMPLE_RATE = 24000
 
-def generate_speech_smallest_ai(client: Smallest, text: str):
-        
-    temp_filename = f"output_temp.wav"
+
+def generate_speech_smallest_ai(client: Smallest, text: str, temp_filename: str = "output_temp.wav"):
     
     client.synthesize(
         text=text,
@@ -17,9 +19,7 @@ def generate_speech_smallest_ai(client: Smallest, text: str):
     return temp_filename
 
 
-def generate_speech_playht(client: Client, text: str, voice_manifest_url: str = "s3://voice-cloning-zero-shot/775ae416-49bb-4fb6-bd45-740f205d20a1/jennifersaad/manifest.json"):
-        
-    temp_filename = f"output_temp.wav"
+def generate_speech_playht(client: Client, text: str, voice_manifest_url: str = "s3://voice-cloning-zero-shot/775ae416-49bb-4fb6-bd45-740f205d20a1/jennifersaad/manifest.json", temp_filename: str = "output_temp.wav"):
 
     options = TTSOptions(voice=voice_manifest_url)
 
@@ -29,10 +29,7 @@ def generate_speech_playht(client: Client, text: str, voice_manifest_url: str =
             
     return temp_filename
 
-def generate_speech_elevenlabs(client: ElevenLabs, text: str, voice_id: str, model_id: str):
-      
-    temp_filename = f"output_temp.wav"
-
+def generate_speech_elevenlabs(client: ElevenLabs, text: str, voice_id: str, model_id: str, temp_filename: str = "output_temp.wav"):
 
     audio = client.text_to_speech.convert(
         text=text,
@@ -42,3 +39,32 @@ def generate_speech_elevenlabs(client: ElevenLabs, text: str, voice_id: str, mod
     )
 
     save(audio, temp_filename)
+
+    return temp_filename
+
+
+def stream_speech_playht(client: Client, text: str, voice_manifest_url: str = "s3://voice-cloning-zero-shot/775ae416-49bb-4fb6-bd45-740f205d20a1/jennifersaad/manifest.json"):
+    """Yield raw PCM chunks as soon as PlayHT sends them"""
+
+    options = TTSOptions(
+        voice=voice_manifest_url,
+        format=Format.FORMAT_RAW,
+        sample_rate=PLAYHT_STREAM_SAMPLE_RATE,
+    )
+
+    for chunk in client.tts(text, options, voice_engine = 'PlayDialog', protocol="http"):
+        yield chunk
+
+
+def stream_speech_elevenlabs(client: ElevenLabs, text: str, voice_id: str, model_id: str):
+    """Yield raw PCM chunks as soon as ElevenLabs sends them"""
+
+    audio = client.text_to_speech.convert_as_stream(
+        text=text,
+        voice_id=voice_id,
+        model_id=model_id,
+        output_format=f"pcm_{ELEVENLABS_STREAM_SAMPLE_RATE}",
+    )
+
+    for chunk in audio:
+        yield chunk
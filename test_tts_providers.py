@@ -0,0 +1,160 @@
+"""TTSProviderPool against local stand-in TTS servers.
+
+Every stand-in route answers like a provider in a given state: healthy,
+slow (past the hedging budget), failing (HTTP 500) or hanging (past the
+hard deadline).
+
+    python -m pytest test_tts_providers.py
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from aiohttp import web
+
+from tts_providers import ProviderError, TTSProvider, TTSProviderPool
+
+# 50ms of 16 bit mono PCM at the providers' 24kHz
+PCM_BODY = np.full(1200, 1000, dtype=np.int16).tobytes()
+
+
+class StandInProvider(TTSProvider):
+    """Provider posting to one route of the stand-in server"""
+
+    def __init__(self, name, base_url, budget=2.0, timeout=10.0):
+        super().__init__("key", name, "model", base_url, budget=budget, timeout=timeout)
+        self.name = name
+
+    def request(self, text):
+        return f"{self.base_url}/{self.voice_id}", {}, {"text": text}
+
+
+class StandInServer:
+    """aiohttp server on its own loop and thread, counting requests per route"""
+
+    def __init__(self):
+        self.requests = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/{state}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return self.runner.addresses[0][1]
+
+    async def handle(self, request):
+        state = request.match_info["state"]
+        self.requests[state] = self.requests.get(state, 0) + 1
+
+        if state == "failing":
+            return web.Response(status=500, text="stand-in failure")
+        if state == "slow":
+            await asyncio.sleep(1.0)
+        elif state == "hanging":
+            await asyncio.sleep(3.0)
+        return web.Response(body=PCM_BODY)
+
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = StandInServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(*providers):
+        pool = TTSProviderPool(list(providers))
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_healthy_provider_decodes_to_feed_format(server, make_pool):
+    pool = make_pool(StandInProvider("healthy", server.url()))
+
+    samples = pool.synthesize("hello")
+
+    assert samples.dtype == np.int16
+    assert samples.shape[1] == 2
+    assert len(samples) > 0
+    assert pool.stats()["healthy"]["wins"] == 1
+
+
+def test_failing_provider_fails_over_and_ranks_last(server, make_pool):
+    failing = StandInProvider("failing", server.url())
+    healthy = StandInProvider("healthy", server.url())
+    pool = make_pool(failing, healthy)
+    server.requests.clear()
+
+    assert len(pool.synthesize("first")) > 0
+    assert pool.stats()["failing"]["failures"] == 1
+    assert pool.stats()["healthy"]["wins"] == 1
+
+    # The failure is remembered, the next request starts with the healthy one
+    pool.synthesize("second")
+    assert server.requests == {"failing": 1, "healthy": 2}
+
+
+def test_slow_provider_is_hedged(server, make_pool):
+    slow = StandInProvider("slow", server.url(), budget=0.1)
+    healthy = StandInProvider("healthy", server.url())
+    pool = make_pool(slow, healthy)
+
+    started = time.monotonic()
+    samples = pool.synthesize("hedge me")
+    elapsed = time.monotonic() - started
+
+    assert len(samples) > 0
+    assert elapsed < 0.8
+    stats = pool.stats()
+    assert stats["hedges"] == 1
+    assert stats["healthy"]["wins"] == 1
+    assert stats["slow"]["wins"] == 0
+    # The cancelled request still counts as slow
+    assert stats["slow"]["latency"] > 0
+
+
+def test_hanging_provider_hits_the_deadline(server, make_pool):
+    hanging = StandInProvider("hanging", server.url(), budget=5.0, timeout=0.3)
+    pool = make_pool(hanging)
+
+    started = time.monotonic()
+    with pytest.raises(ProviderError):
+        pool.synthesize("never answered")
+
+    assert time.monotonic() - started < 2.0
+    assert pool.stats()["hanging"]["failures"] == 1
+
+
+def test_all_failing_raises(server, make_pool):
+    pool = make_pool(
+        StandInProvider("failing", server.url()),
+        StandInProvider("hanging", server.url(), timeout=0.3),
+    )
+
+    with pytest.raises(ProviderError, match="All TTS providers failed"):
+        pool.synthesize("nobody home")
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Canonical form of an utterance, whitespace and unicode differences
+    do not change the synthesized audio"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(provider, voice_id, model_id, text, audio_format):
+    payload = json.dumps(
+        [provider, voice_id, model_id, normalize_text(text), audio_format],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Content-addressed on-disk cache of synthesized audio.
+
+    Every entry is one file named after its cache_key(). Entries are
+    written to a temp file and renamed into place, so a crash never leaves
+    a truncated entry behind. The total size is kept under `max_bytes` by
+    evicting the least recently used entries, the recency order survives
+    restarts through the file modification times.
+    """
+
+    def __init__(self, directory="tts_cache", max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".tmp-"):
+                # Partial write of a crashed run, never renamed into place
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+
+        with self.lock:
+            self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Cached audio (bytes) for `key`, None on a miss.
+
+        Read under the lock, a concurrent put() can not evict the file
+        between the lookup and the read.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            path = self.path(key)
+            try:
+                with open(path, "rb") as cached_file:
+                    data = cached_file.read()
+                os.utime(path)
+            except OSError:
+                # Removed behind our back
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """Store `data` (bytes) under `key` atomically"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, self.path(key))
+        except OSError as e:
+            print(f"TTS cache: unable to store {key}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            self.evict()
+
+    def put_file(self, key, source_path):
+        with open(source_path, "rb") as source:
+            self.put(key, source.read())
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,172 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+SENTENCE_END = re.compile(r"[.!?]+\s+|\n+")
+CLAUSE_END = re.compile(r"[,;:]\s+")
+
+
+def split_sentences(text, min_chars=25):
+    """Split text into sentences, merging fragments shorter than `min_chars`
+    into the next one so each TTS request still has some prosody context"""
+    pieces = [piece.strip() for piece in SENTENCE_BOUNDARY.split(text.strip())]
+    sentences = []
+    pending = ""
+
+    for piece in pieces:
+        if not piece:
+            continue
+        pending = f"{pending} {piece}".strip()
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = ""
+
+    if pending:
+        if sentences and len(pending) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+
+    return sentences
+
+
+class ClauseSegmenter:
+    """Cuts streamed LLM text into segments as soon as they are complete.
+
+    A segment ends at a sentence boundary once it has `min_chars`. Clauses
+    that run past `max_chars` without one are cut at a comma so speech is
+    never held back by a long sentence.
+    """
+
+    def __init__(self, min_chars=25, max_chars=120):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+
+    def next_cut(self):
+        for match in SENTENCE_END.finditer(self.buffer):
+            if len(self.buffer[: match.end()].strip()) >= self.min_chars:
+                return match.end()
+
+        if len(self.buffer) >= self.max_chars:
+            for match in CLAUSE_END.finditer(self.buffer):
+                if len(self.buffer[: match.end()].strip()) >= self.min_chars:
+                    return match.end()
+        return None
+
+    def feed(self, text):
+        """Add streamed text, returns the segments it completed"""
+        self.buffer += text
+        segments = []
+        cut = self.next_cut()
+        while cut is not None:
+            segments.append(self.buffer[:cut].strip())
+            self.buffer = self.buffer[cut:]
+            cut = self.next_cut()
+        return segments
+
+    def flush(self):
+        """Whatever is left once the stream ended"""
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class OrderedAppender:
+    """Appends the results of futures to a PCMStream in submission order.
+
+    Runs from the futures' done callbacks: a result is appended as soon as
+    it and every one submitted before it are done, independent of when the
+    next segment is submitted. After the first error nothing more is
+    appended, wait() raises it.
+    """
+
+    def __init__(self, audio_stream):
+        self.audio_stream = audio_stream
+        self.lock = threading.Lock()
+        self.appended_all = threading.Condition(self.lock)
+        self.futures = []
+        self.appended = 0
+        self.error = None
+        self.closed = False
+
+    def add(self, future):
+        with self.lock:
+            self.futures.append(future)
+        future.add_done_callback(self.on_done)
+
+    def on_done(self, _):
+        with self.lock:
+            while self.appended < len(self.futures) and self.futures[self.appended].done():
+                future = self.futures[self.appended]
+                self.appended += 1
+                if self.closed or self.error is not None or future.cancelled():
+                    continue
+                try:
+                    samples = future.result()
+                except Exception as e:
+                    self.error = e
+                    continue
+                if samples is not None:
+                    self.audio_stream.extend(samples)
+            self.appended_all.notify_all()
+
+    def wait(self):
+        with self.lock:
+            while self.appended < len(self.futures):
+                self.appended_all.wait()
+            if self.error is not None:
+                raise self.error
+
+    def close(self):
+        """Cancel what did not start, drop results still to come"""
+        with self.lock:
+            self.closed = True
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+
+class SentencePipeline:
+    """Synthesizes an utterance sentence by sentence, in parallel.
+
+    The first sentence is streamed straight into the output PCMStream so
+    playback starts on its first chunk. The remaining sentences are
+    synthesized concurrently by a small worker pool and appended strictly
+    in order as they complete, so the final audio matches a single request
+    while later sentences are generated during playback.
+
+    `stream_into(text, audio_stream)` pushes chunks into a stream without
+    finishing it, `synthesize(text)` returns the complete int16 samples.
+    """
+
+    def __init__(self, stream_into, synthesize, workers=3):
+        self.stream_into = stream_into
+        self.synthesize = synthesize
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def speak(self, text, audio_stream):
+        self.speak_segments(split_sentences(text), audio_stream)
+
+    def speak_segments(self, segments, audio_stream):
+        """Like speak(), for segments still being produced (a generator).
+
+        Every segment is submitted as soon as it is yielded, finished
+        segments are appended in order as soon as they are synthesized,
+        while the rest are still coming.
+        """
+        appender = OrderedAppender(audio_stream)
+
+        try:
+            for index, segment in enumerate(segments):
+                if index == 0:
+                    appender.add(self.executor.submit(self.stream_into, segment, audio_stream))
+                else:
+                    appender.add(self.executor.submit(self.synthesize, segment))
+            appender.wait()
+        finally:
+            appender.close()
+            audio_stream.finish()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,301 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+
+import aiohttp
+
+from audio import PCMStream
+from tts_cache import cache_key
+
+
+class ProviderError(Exception):
+    pass
+
+
+class TTSProvider(ABC):
+    """One TTS HTTP API, returning raw 16 bit mono PCM at `sample_rate`.
+
+    `budget` is the latency after which the pool hedges to the next
+    provider, `timeout` the hard deadline of a request. `base_url` can
+    point at a local stand-in server.
+    """
+
+    name = None
+    sample_rate = 24000
+
+    def __init__(self, api_key, voice_id, model_id, base_url, budget=2.0, timeout=10.0):
+        self.api_key = api_key
+        self.voice_id = voice_id
+        self.model_id = model_id
+        self.base_url = base_url.rstrip("/")
+        self.budget = budget
+        self.timeout = timeout
+
+    def identity(self):
+        return [self.name, self.voice_id, self.model_id]
+
+    @abstractmethod
+    def request(self, text):
+        """(url, headers, json body) of the synthesis request"""
+
+    def decode(self, data):
+        """Feed format int16 samples of a response body"""
+        stream = PCMStream(self.sample_rate)
+        stream.push(data)
+        stream.finish()
+        return stream.read(0, len(stream))
+
+    async def synthesize(self, session, text):
+        url, headers, body = self.request(text)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with session.post(url, headers=headers, json=body, timeout=timeout) as response:
+            if response.status != 200:
+                detail = (await response.text())[:200]
+                raise ProviderError(f"HTTP {response.status}: {detail}")
+            data = await response.read()
+
+        if not data:
+            raise ProviderError("Empty audio response")
+        return self.decode(data)
+
+
+class ElevenLabsProvider(TTSProvider):
+
+    name = "elevenlabs"
+    sample_rate = 22050
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            os.environ["ELEVENLABS_API_KEY"],
+            os.environ["ELEVENLABS_VOICE_ID"],
+            os.environ["ELEVENLABS_MODEL_ID"],
+            os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io"),
+            **kwargs,
+        )
+
+    def request(self, text):
+        url = (
+            f"{self.base_url}/v1/text-to-speech/{self.voice_id}"
+            f"?output_format=pcm_{self.sample_rate}"
+        )
+        headers = {"xi-api-key": self.api_key}
+        return url, headers, {"text": text, "model_id": self.model_id}
+
+
+class PlayHTProvider(TTSProvider):
+
+    name = "playht"
+
+    def __init__(self, user_id, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_id = user_id
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            os.environ["PLAY_HT_USER_ID"],
+            os.environ["PLAY_HT_API_KEY"],
+            os.environ["PLAYHT_VOICE_MANIFEST_URL"],
+            "PlayDialog",
+            os.getenv("PLAYHT_BASE_URL", "https://api.play.ht"),
+            **kwargs,
+        )
+
+    def request(self, text):
+        headers = {"X-USER-ID": self.user_id, "AUTHORIZATION": self.api_key}
+        body = {
+            "text": text,
+            "voice": self.voice_id,
+            "voice_engine": self.model_id,
+            "output_format": "raw",
+            "sample_rate": self.sample_rate,
+        }
+        return f"{self.base_url}/api/v2/tts/stream", headers, body
+
+
+class SmallestProvider(TTSProvider):
+
+    name = "smallestai"
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            os.environ["SMALLEST_API_KEY"],
+            os.environ["SMALLEST_VOICE_ID"],
+            os.environ["SMALLEST_MODEL"],
+            os.getenv("SMALLEST_BASE_URL", "https://waves-api.smallest.ai"),
+            **kwargs,
+        )
+
+    def request(self, text):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        body = {
+            "text": text,
+            "voice_id": self.voice_id,
+            "sample_rate": self.sample_rate,
+            "speed": 1.0,
+            "add_wav_header": False,
+        }
+        return f"{self.base_url}/api/v1/{self.model_id}/get_speech", headers, body
+
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (ElevenLabsProvider, PlayHTProvider, SmallestProvider)
+}
+
+
+class ProviderHealth:
+    """Exponentially weighted latency and error rate of one provider"""
+
+    def __init__(self, alpha=0.2, error_penalty=10.0):
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def record_latency(self, latency):
+        self.latency += self.alpha * (latency - self.latency)
+
+    def record_success(self, latency):
+        self.requests += 1
+        self.record_latency(latency)
+        self.error_rate -= self.alpha * self.error_rate
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate += self.alpha * (1.0 - self.error_rate)
+
+    def score(self):
+        """Expected cost in seconds, lower is better"""
+        return self.latency + self.error_rate * self.error_penalty
+
+
+class TTSProviderPool:
+    """Synthesizes through the healthiest of several TTS providers.
+
+    Requests run on a private asyncio loop in a daemon thread that owns a
+    single aiohttp session, so connections are pooled and kept alive
+    across utterances. Providers are tried in order of their health score:
+    when one fails the next is started immediately, when it is still busy
+    after its latency `budget` the next one is started alongside (hedging)
+    and whichever answers first wins. Every request has a hard deadline.
+    """
+
+    def __init__(self, providers, connections_per_host=4):
+        self.providers = providers
+        self.health = {provider.name: ProviderHealth() for provider in providers}
+        self.wins = {provider.name: 0 for provider in providers}
+        self.hedges = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.session = self.run(self.open_session(connections_per_host))
+
+    @classmethod
+    def from_env(cls, names, **kwargs):
+        """Pool over provider names (TTS_Options values), configured from env"""
+        return cls([PROVIDERS[name].from_env() for name in names], **kwargs)
+
+    async def open_session(self, connections_per_host):
+        connector = aiohttp.TCPConnector(
+            limit_per_host=connections_per_host, keepalive_timeout=60
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def cache_key(self, text, audio_format):
+        identities = [provider.identity() for provider in self.providers]
+        return cache_key("pool", identities, None, text, audio_format)
+
+    def synthesize(self, text):
+        """Blocking synthesis for worker threads, returns feed format samples"""
+        return self.run(self.synthesize_async(text))
+
+    async def attempt(self, provider, text):
+        health = self.health[provider.name]
+        started = time.monotonic()
+        try:
+            samples = await provider.synthesize(self.session, text)
+        except asyncio.CancelledError:
+            # Lost a hedge, it was at least this slow
+            health.record_latency(time.monotonic() - started)
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        health.record_success(time.monotonic() - started)
+        return samples
+
+    async def synthesize_async(self, text):
+        ranked = sorted(self.providers, key=lambda p: self.health[p.name].score())
+        pending = {}
+        errors = []
+
+        def launch():
+            provider = ranked[len(pending) + len(errors)]
+            pending[asyncio.ensure_future(self.attempt(provider, text))] = provider
+            return provider
+
+        latest = launch()
+        try:
+            while pending:
+                more = len(pending) + len(errors) < len(ranked)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=latest.budget if more else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if not done:
+                    # Over budget, ask the next provider as well
+                    self.hedges += 1
+                    latest = launch()
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        samples = task.result()
+                    except Exception as e:
+                        print(f"TTS provider {provider.name} failed: {e!r}")
+                        errors.append(f"{provider.name}: {e!r}")
+                        continue
+                    self.wins[provider.name] += 1
+                    return samples
+
+                if not pending and len(errors) < len(ranked):
+                    latest = launch()
+
+            raise ProviderError("All TTS providers failed: " + "; ".join(errors))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            name: {
+                "score": round(health.score(), 3),
+                "latency": round(health.latency, 3),
+                "error_rate": round(health.error_rate, 3),
+                "requests": health.requests,
+                "failures": health.failures,
+                "wins": self.wins[name],
+            }
+            for name, health in self.health.items()
+        } | {"hedges": self.hedges}
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
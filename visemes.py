@@ -0,0 +1,88 @@
+import numpy as np
+
+from audio import AUDIO_SAMPLE_RATE
+
+# Vowel parameters and their reference (F1, F2) formants in Hz
+VOWEL_FORMANTS = {
+    "ParamA": (800, 1250),
+    "ParamI": (300, 2300),
+    "ParamU": (350, 1350),
+    "ParamE": (500, 1900),
+    "ParamO": (500, 850),
+}
+
+F1_RANGE = (250, 950)
+F2_RANGE = (700, 3000)
+# Formants closer than this are one peak seen twice
+MIN_FORMANT_GAP = 250
+
+# Cepstral cutoff, 1.5ms keeps voices up to ~600Hz pitch resolved
+LIFTER_SECONDS = 0.0015
+
+# Below this RMS a frame is treated as silence, no vowel shape
+SILENCE_RMS = 0.01
+
+
+def frame_windows(samples, edges, length):
+    """(frames, length) mono windows starting at every frame edge, zero
+    padded past the end of `samples`"""
+    mono = samples.astype(np.float32).mean(axis=1) / 32768
+    mono = np.concatenate([mono, np.zeros(length, dtype=np.float32)])
+    return mono[edges[:-1, None] + np.arange(length)]
+
+
+def spectral_envelope(windows, n_fft, lifter, pre_emphasis=0.97):
+    """Smoothed log magnitude spectra (cepstral liftering), one per row.
+    `lifter` has to stay below the pitch period to drop the harmonics."""
+    emphasized = windows[:, 1:] - pre_emphasis * windows[:, :-1]
+    spectrum = np.fft.rfft(emphasized * np.hanning(emphasized.shape[1]), n=n_fft)
+    cepstrum = np.fft.irfft(np.log(np.abs(spectrum) + 1e-9), n=n_fft)
+    cepstrum[:, lifter : n_fft - lifter] = 0
+    return np.fft.rfft(cepstrum, n=n_fft).real
+
+
+def estimate_formants(envelope, freqs):
+    """F1 and F2 of every frame, the strongest envelope peaks of their range"""
+    in_f1 = (freqs >= F1_RANGE[0]) & (freqs <= F1_RANGE[1])
+    f1 = freqs[np.argmax(np.where(in_f1, envelope, -np.inf), axis=1)]
+
+    in_f2 = (
+        (freqs[None, :] >= np.maximum(F2_RANGE[0], f1[:, None] + MIN_FORMANT_GAP))
+        & (freqs[None, :] <= F2_RANGE[1])
+    )
+    f2 = freqs[np.argmax(np.where(in_f2, envelope, -np.inf), axis=1)]
+    return f1, f2
+
+
+def vowel_weights(samples, edges, sample_rate=AUDIO_SAMPLE_RATE, temperature=0.05):
+    """(frames, vowels) weights in VOWEL_FORMANTS order for int16 PCM split
+    at `edges`, every row sums to 1 or is all zero for silent frames.
+
+    The whole clip goes through one batched FFT: formants are the peaks of
+    the cepstrally smoothed spectrum, each frame is scored against the
+    reference formants of every vowel by distance on a log frequency scale.
+    """
+    count = len(edges) - 1
+    if count <= 0:
+        return np.zeros((0, len(VOWEL_FORMANTS)), dtype=np.float32)
+
+    length = int(np.max(edges[1:] - edges[:-1]))
+    n_fft = 1 << int(np.ceil(np.log2(max(length, 256))))
+    windows = frame_windows(samples, edges, length)
+
+    envelope = spectral_envelope(windows, n_fft, int(sample_rate * LIFTER_SECONDS))
+    freqs = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    f1, f2 = estimate_formants(envelope, freqs)
+
+    references = np.log(np.array(list(VOWEL_FORMANTS.values()), dtype=np.float64))
+    distance = (np.log(f1)[:, None] - references[None, :, 0]) ** 2 + (
+        np.log(f2)[:, None] - references[None, :, 1]
+    ) ** 2
+
+    scores = -distance / temperature
+    weights = np.exp(scores - scores.max(axis=1, keepdims=True))
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    rms = np.sqrt(np.mean(windows**2, axis=1))
+    weights[rms < SILENCE_RMS] = 0
+    return weights.astype(np.float32)